@@ -1,57 +1,68 @@
-# api/config.py
 """
 Configuration management for the API
 Loads environment variables and provides defaults
 """
 import os
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 from dotenv import load_dotenv
 
-# Load .env file if it exists (for local development)
-load_dotenv()
-
 
+@dataclass(frozen=True, slots=True)
 class Settings:
     """Application settings loaded from environment variables"""
-    
+
     # OneSignal App and API Keys
-    signal_post_app_id: Optional[str] = os.getenv("signal_post_app_id")
-    signal_post_api_key: Optional[str] = os.getenv("signal_post_api_key")
-    emea_se_demo_app_id: Optional[str] = os.getenv("emea_se_demo_app_id")
-    emea_se_demo_api_key: Optional[str] = os.getenv("emea_se_demo_api_key")
-    signal_air_app_id: Optional[str] = os.getenv("signal_air_app_id")
-    signal_air_api_key: Optional[str] = os.getenv("signal_air_api_key")
-    
-
-    #OneSignal Teplate IDs
-    emea_se_demo_sms_otp: str = "a6f35326-6b86-4076-952c-1b3bbee7d391"
-    signal_post_delivery_pickup: str = "e403dea4-3b4d-4691-bc72-959da1857d2b"
-    signal_post_in_transit: str = "adf0c70e-68f1-4068-901b-bc5b78012f0d"
-    signal_post_delivered: str = "b638434a-03e4-4e78-9da2-a09b17edace2"
-
-    
+    signal_post_app_id: Optional[str] = None
+    signal_post_api_key: Optional[str] = None
+    emea_se_demo_app_id: Optional[str] = None
+    emea_se_demo_api_key: Optional[str] = None
+    signal_air_app_id: Optional[str] = None
+    signal_air_api_key: Optional[str] = None
+
+    #OneSignal Teplate IDs (parsed once; use str() when sending to the API)
+    emea_se_demo_sms_otp: uuid.UUID = uuid.UUID("a6f35326-6b86-4076-952c-1b3bbee7d391")
+    signal_post_delivery_pickup: uuid.UUID = uuid.UUID("e403dea4-3b4d-4691-bc72-959da1857d2b")
+    signal_post_in_transit: uuid.UUID = uuid.UUID("adf0c70e-68f1-4068-901b-bc5b78012f0d")
+    signal_post_delivered: uuid.UUID = uuid.UUID("b638434a-03e4-4e78-9da2-a09b17edace2")
+
     # Vercel KV Configuration
-    KV_URL: Optional[str] = os.getenv("KV_URL")
-    KV_REST_API_URL: Optional[str] = os.getenv("KV_REST_API_URL")
-    KV_REST_API_TOKEN: Optional[str] = os.getenv("KV_REST_API_TOKEN")
-    KV_REST_API_READ_ONLY_TOKEN: Optional[str] = os.getenv("KV_REST_API_READ_ONLY_TOKEN")
+    KV_URL: Optional[str] = None
+    KV_REST_API_URL: Optional[str] = None
+    KV_REST_API_TOKEN: Optional[str] = None
+    KV_REST_API_READ_ONLY_TOKEN: Optional[str] = None
+    KV_SERIALIZER: str = "json"  # Default value encoding: "json" or "msgpack"
+    KV_MAX_CONNECTIONS: int = 32  # Redis connection pool size per process
 
     # Postgres Database Configuration (Railway provides DATABASE_URL)
-    DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL")
+    DATABASE_URL: Optional[str] = None
+    # Connection pool per worker process; by default a 20 + 40 connection budget
+    # is split across WEB_CONCURRENCY workers to stay under Postgres' max_connections
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 40
+
+    # Public URL of this server, used in links we hand out (e.g. ICS downloads)
+    PUBLIC_BASE_URL: Optional[str] = None
 
     # Environment
-    ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
-    
+    ENVIRONMENT: str = "development"
+    LOG_LEVEL: str = "INFO"
+
+    # Allowed CORS origins (comma-separated in CORS_ORIGINS); empty means any origin, without credentials
+    CORS_ORIGINS: tuple[str, ...] = ()
+
     @property
     def is_development(self) -> bool:
         """Check if running in development mode"""
         return self.ENVIRONMENT == "development"
-    
+
     @property
     def has_onesignal(self) -> bool:
         """Check if OneSignal is configured"""
         return True
-    
+
     @property
     def has_kv(self) -> bool:
         """Check if Vercel KV is configured"""
@@ -63,11 +74,62 @@ class Settings:
         return bool(self.DATABASE_URL)
 
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Build the settings once per process.
+    Loads the .env file (for local development) and reads os.environ a single time.
+    """
+    load_dotenv()
+    env = os.environ
+    workers = max(1, int(env.get("WEB_CONCURRENCY", 1)))
+
+    return Settings(
+        signal_post_app_id=env.get("signal_post_app_id"),
+        signal_post_api_key=env.get("signal_post_api_key"),
+        emea_se_demo_app_id=env.get("emea_se_demo_app_id"),
+        emea_se_demo_api_key=env.get("emea_se_demo_api_key"),
+        signal_air_app_id=env.get("signal_air_app_id"),
+        signal_air_api_key=env.get("signal_air_api_key"),
+        KV_URL=env.get("KV_URL"),
+        KV_REST_API_URL=env.get("KV_REST_API_URL"),
+        KV_REST_API_TOKEN=env.get("KV_REST_API_TOKEN"),
+        KV_REST_API_READ_ONLY_TOKEN=env.get("KV_REST_API_READ_ONLY_TOKEN"),
+        KV_SERIALIZER=env.get("KV_SERIALIZER", "json").lower(),
+        KV_MAX_CONNECTIONS=int(env.get("KV_MAX_CONNECTIONS", 32)),
+        DATABASE_URL=env.get("DATABASE_URL"),
+        DB_POOL_SIZE=int(env.get("DB_POOL_SIZE", max(1, 20 // workers))),
+        DB_MAX_OVERFLOW=int(env.get("DB_MAX_OVERFLOW", max(1, 40 // workers))),
+        PUBLIC_BASE_URL=(env.get("PUBLIC_BASE_URL") or "").rstrip("/") or None,
+        ENVIRONMENT=env.get("ENVIRONMENT", "development"),
+        LOG_LEVEL=env.get("LOG_LEVEL", "INFO").upper(),
+        CORS_ORIGINS=tuple(
+            origin.strip().rstrip("/")
+            for origin in env.get("CORS_ORIGINS", "").split(",")
+            if origin.strip()
+        ),
+    )
+
+
 # Create a single instance
-settings = Settings()
+settings = get_settings()
+
+# OneSignal App ID -> REST API key for every configured app, built once at import
+# (one dict probe instead of comparing against each app's settings)
+APP_ID_TO_API_KEY: dict[str, str] = {
+    app_id: api_key
+    for app_id, api_key in (
+        (settings.signal_post_app_id, settings.signal_post_api_key),
+        (settings.emea_se_demo_app_id, settings.emea_se_demo_api_key),
+        (settings.signal_air_app_id, settings.signal_air_api_key),
+    )
+    if app_id and api_key
+}
+
 
-# Print configuration status on startup (helpful for debugging)
-print(f"Environment: {settings.ENVIRONMENT}")
-print(f"OneSignal configured: {settings.has_onesignal}")
-print(f"Vercel KV configured: {settings.has_kv}")
-print(f"Postgres configured: {settings.has_database}")
\ No newline at end of file
+if __name__ == "__main__":
+    # Print configuration status (helpful for debugging): python -m api.config
+    print(f"Environment: {settings.ENVIRONMENT}")
+    print(f"OneSignal configured: {settings.has_onesignal}")
+    print(f"Vercel KV configured: {settings.has_kv}")
+    print(f"Postgres configured: {settings.has_database}")
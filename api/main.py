@@ -3,33 +3,69 @@
 Main FastAPI application
 This file sets up the app and includes all routers
 """
-from contextlib import asynccontextmanager
-from fastapi import FastAPI
+import asyncio
+import atexit
+import logging
+import queue
+import orjson
+from contextlib import AsyncExitStack, asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .routers import auth, delivery, dashboard, coupon, flight_update, live_activity, calendar, webhooks, custom_webhook
 from .config import settings
 from .storage.kv_store import kv_store
 from .services.database_service import database_service
+from .services.delivery_service import delivery_service
+from .services.flight_update import flight_service
+from .services.one_signal_message_service import onesignal_message_service
 
+# Logging: handlers on the request path only enqueue records; a background
+# listener thread formats them and writes to stderr, so log I/O never blocks
+# the event loop. Set LOG_LEVEL=WARNING to drop the per-request info lines.
+_log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_output)
+logging.root.setLevel(settings.LOG_LEVEL)
+logging.root.addHandler(QueueHandler(_log_queue))
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-print(f"KV configured: {settings.has_kv}")
-print(f"KV Store initialized: {kv_store is not None}")
-print(f"Database configured: {settings.has_database}")
+logger = logging.getLogger(__name__)
+
+logger.debug("KV configured: %s", settings.has_kv)
+logger.debug("Database configured: %s", settings.has_database)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Application lifespan manager.
-    Handles startup and shutdown events.
+    Startup tasks run concurrently; shutdown callbacks run in reverse order.
     """
-    # Startup
-    print("🚀 Starting OneSignal API Server...")
-    await database_service.initialize()
-    yield
-    # Shutdown
-    print("🛑 Shutting down...")
-    await database_service.shutdown()
+    async with AsyncExitStack() as stack:
+        # Startup
+        logger.info("🚀 Starting OneSignal API Server...")
+        stack.push_async_callback(database_service.shutdown)
+        stack.push_async_callback(kv_store.close)
+        stack.push_async_callback(onesignal_message_service.shutdown)
+        # Background sequences are cancelled first (callbacks run in reverse order)
+        stack.push_async_callback(delivery_service.shutdown)
+        stack.push_async_callback(flight_service.shutdown)
+        await asyncio.gather(
+            database_service.initialize(),
+            kv_store.connect(),
+            onesignal_message_service.startup(),
+        )
+        if not kv_store.redis_client:
+            # Redis expires keys itself; the local fallback needs a periodic sweep
+            sweeper = asyncio.create_task(kv_store.sweep_expired())
+            stack.callback(sweeper.cancel)
+        yield
+        # Shutdown
+        logger.info("🛑 Shutting down...")
 
 
 # Create the FastAPI app
@@ -37,45 +73,54 @@ app = FastAPI(
     title="OneSignal API Server",
     description="Claudio's backend server for handling API logic and OneSignal integration",
     version="2.1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson encodes dicts, datetimes and UUIDs natively
 )
 
 # Configure CORS
+# With an explicit origin list the middleware does a set lookup and sends a fixed
+# Access-Control-Allow-Origin; a "*" + credentials combination would make it echo
+# every request's Origin instead. Preflight OPTIONS are answered by the middleware
+# itself and never reach the routers.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure properly for production
-    allow_credentials=True,
+    allow_origins=list(settings.CORS_ORIGINS) or ["*"],
+    allow_credentials=bool(settings.CORS_ORIGINS),
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
 # Root endpoint
+# The welcome payload never changes, so it is serialized once at import
+_ROOT_BYTES = orjson.dumps({
+    "message": "Welcome to Claudio's OneSignal API Server!",
+    "version": "2.1.0",
+    "status": "running",
+    "endpoints": {
+        "/": "This welcome message",
+        "/auth/otp": "POST - Generate OTP",
+        "/auth/verify": "POST - Verify OTP",
+        "/delivery": "POST - Start delivery tracking",
+        "/coupon/request": "POST - Generate coupon code",
+        "/coupon/validate": "POST - Validate coupon code",
+        "/flight-update": "POST - Start flight update Live Activity",
+        "/live-activity": "POST - Start Signal Post Live Activity demo sequence",
+        "/calendar-data": "POST - Generate Google Calendar URL and ICS file",
+        "/calendar/{id}.ics": "GET - Download ICS calendar file",
+        "/webhooks/onesignal": "POST - Receive OneSignal webhook events",
+        "/messages/{app_id}/{external_id}": "GET - Retrieve user's notification inbox",
+        "/webhooks/health": "GET - Check webhook system health",
+        "/docs": "Interactive API documentation",
+        "/redoc": "Alternative API documentation"
+    }
+})
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     """Welcome endpoint"""
-    return {
-        "message": "Welcome to Claudio's OneSignal API Server!",
-        "version": "2.1.0",
-        "status": "running",
-        "endpoints": {
-            "/": "This welcome message",
-            "/auth/otp": "POST - Generate OTP",
-            "/auth/verify": "POST - Verify OTP",
-            "/delivery": "POST - Start delivery tracking",
-            "/coupon/request": "POST - Generate coupon code",
-            "/coupon/validate": "POST - Validate coupon code",
-            "/flight-update": "POST - Start flight update Live Activity",
-            "/live-activity": "POST - Start Signal Post Live Activity demo sequence",
-            "/calendar-data": "POST - Generate Google Calendar URL and ICS file",
-            "/calendar/{id}.ics": "GET - Download ICS calendar file",
-            "/webhooks/onesignal": "POST - Receive OneSignal webhook events",
-            "/messages/{app_id}/{external_id}": "GET - Retrieve user's notification inbox",
-            "/webhooks/health": "GET - Check webhook system health",
-            "/docs": "Interactive API documentation",
-            "/redoc": "Alternative API documentation"
-        }
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 
 # Include routers
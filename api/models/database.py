@@ -3,13 +3,39 @@
 Database models for storing OneSignal webhook events
 Uses SQLAlchemy with async support for Postgres
 """
-from sqlalchemy import Column, String, DateTime, Index, Text
+from datetime import datetime
+from typing import Any, Optional
+from sqlalchemy import String, DateTime, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.sql import func
+import os
+import time
 import uuid
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    """Declarative base for all database models"""
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Generate a time-ordered UUID (RFC 9562 version 7).
+
+    Layout: 48-bit Unix timestamp in ms | version | 12 random bits | variant | 62 random bits.
+    Keys generated later sort later, so primary-key inserts append to the
+    right-most btree page instead of dirtying random pages like uuid4 does.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | (rand >> 68) << 64
+        | 0b10 << 62
+        | rand & ((1 << 62) - 1)
+    )
+    return uuid.UUID(int=value)
 
 
 class MessageEvent(Base):
@@ -21,16 +47,18 @@ class MessageEvent(Base):
     """
     __tablename__ = "message_events"
 
-    # Primary key - auto-generated UUID
-    id = Column(
+    # Primary key - auto-generated, time-ordered UUID.
+    # Always set by the app (uuid7): ORM inserts use the default and the COPY
+    # writer sends it, so there is no server-side default to fall back on.
+    id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True),
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         comment="Unique identifier for this event"
     )
 
     # OneSignal App ID - identifies which of the 10 apps sent this
-    app_id = Column(
+    app_id: Mapped[str] = mapped_column(
         String(36),
         nullable=False,
         index=True,
@@ -38,7 +66,7 @@ class MessageEvent(Base):
     )
 
     # User identity - the external_id from OneSignal.login()
-    external_id = Column(
+    external_id: Mapped[str] = mapped_column(
         String(255),
         nullable=False,
         index=True,
@@ -46,14 +74,14 @@ class MessageEvent(Base):
     )
 
     # Event type - what happened
-    event_type = Column(
+    event_type: Mapped[str] = mapped_column(
         String(50),
         nullable=False,
         comment="Event type: notification.sent, notification.delivered, notification.clicked, etc."
     )
 
     # OneSignal's notification ID - links related events together
-    notification_id = Column(
+    notification_id: Mapped[Optional[str]] = mapped_column(
         String(36),
         nullable=True,
         index=True,
@@ -61,21 +89,21 @@ class MessageEvent(Base):
     )
 
     # The actual notification content (title, body, image, etc.)
-    message_contents = Column(
+    message_contents: Mapped[Optional[dict[str, Any]]] = mapped_column(
         JSONB,
         nullable=True,
         comment="Notification content: title, body, image, action buttons, custom data"
     )
 
     # Full webhook payload - stored for debugging and future flexibility
-    event_payload = Column(
+    event_payload: Mapped[Optional[dict[str, Any]]] = mapped_column(
         JSONB,
         nullable=True,
         comment="Complete webhook payload from OneSignal"
     )
 
     # Timestamp when we received this event
-    created_at = Column(
+    created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         server_default=func.now(),
         nullable=False,
@@ -91,13 +119,33 @@ class MessageEvent(Base):
             'external_id',
             created_at.desc()
         ),
+        # Same lookup filtered by event type ("only sent/delivered events"),
+        # so the IN (...) filter and the newest-first ORDER BY stay on one index
+        Index(
+            'idx_user_type_lookup',
+            'app_id',
+            'external_id',
+            'event_type',
+            created_at.desc()
+        ),
+        # BRIN index for time-range scans (retention cleanup deletes by created_at).
+        # Rows are appended in created_at order, so it stays tiny next to a btree.
+        Index(
+            'idx_events_created_brin',
+            'created_at',
+            postgresql_using='brin',
+            postgresql_with={'pages_per_range': 32}
+        ),
     )
 
     def __repr__(self):
         return f"<MessageEvent(id={self.id}, app_id={self.app_id}, external_id={self.external_id}, event_type={self.event_type})>"
 
     def to_dict(self):
-        """Convert to dictionary for JSON serialization"""
+        """
+        Convert to dictionary for JSON serialization.
+        created_at stays a datetime; ORJSONResponse emits it as RFC 3339.
+        """
         return {
             "id": str(self.id),
             "app_id": self.app_id,
@@ -106,5 +154,5 @@ class MessageEvent(Base):
             "notification_id": self.notification_id,
             "message_contents": self.message_contents,
             "event_payload": self.event_payload,
-            "created_at": self.created_at.isoformat() if self.created_at else None
+            "created_at": self.created_at
         }
@@ -3,104 +3,111 @@
 Data models (schemas) for your API
 These define what data your API expects and returns
 """
-from pydantic import BaseModel, Field
-from typing import Optional, Literal, List
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field
+from dataclasses import dataclass
+from typing import Annotated, Optional, Literal, List
 from datetime import datetime
 
 
+# Shared field types (one definition reused by every model that takes them).
+# Patterns are checked by pydantic-core's compiled regex before a handler runs.
+PhoneNumber = Annotated[str, Field(pattern=r"^\+\d{7,15}$", json_schema_extra={"example": "+1234567890"})]  # E.164
+CouponCode = Annotated[str, Field(pattern=r"^[A-Z0-9]{6}$", json_schema_extra={"example": "A1B2C3"})]  # see CouponService
+UserId = Annotated[str, Field(json_schema_extra={"example": "user123"})]
+
+
 # Request models (what users send to your API)
 class OTPRequest(BaseModel):
     """Request to generate an OTP"""
-    phone_number: str = Field(
+    phone_number: PhoneNumber = Field(
         ..., 
-        example="+1234567890",
         description="Phone number with country code"
     )
-    request_otp: bool = Field(
+    request_otp: Literal[True] = Field(
         ...,
-        example=True,  # Changed from 'true' to True (no quotes for boolean)
+        json_schema_extra={"example": True},  # Changed from 'true' to True (no quotes for boolean)
         description="must be 'true' to request an OTP"
     )
     
 class VerifyOTPRequest(BaseModel):
     """Request to verify an OTP"""
-    phone_number: str = Field(
+    phone_number: PhoneNumber = Field(
         ..., 
-        example="+1234567890",
         description="Phone number that requested the OTP"
     )
     signal_code: str = Field(
         ...,
-        example="12345",
+        json_schema_extra={"example": "12345"},
         description="The 5-digit OTP code"
     )
 
 class DeliveryRequest(BaseModel):  # Fixed: BaseModel not baseModel
     """Request to start Signal Post Parcel Delivery"""  # Fixed: proper quotes
+    model_config = ConfigDict(frozen=True)  # Never mutated after validation
+
     external_id: str = Field(  # Fixed: added colon after external_id
         ...,
-        example="YCYEL51G",
+        json_schema_extra={"example": "YCYEL51G"},
         description="unique user id"
     )
-    send_parcel: bool = Field(  # Fixed: added colon after send_parcel
+    send_parcel: Literal[True] = Field(  # Fixed: added colon after send_parcel
         ...,
-        example=True,  # Fixed: True not 'true'
+        json_schema_extra={"example": True},  # Fixed: True not 'true'
         description="must be 'true' to send a parcel"
     )
     parcel_destination: str = Field(  # Fixed: added colon after parcel_destination
         ...,
-        example="Locker",
+        json_schema_extra={"example": "Locker"},
         description="The destination of the parcel"  # Fixed typo: destination
     )
     parcel_size: str = Field(
         ...,
-        example="Medium",
+        json_schema_extra={"example": "Medium"},
         description="Size of the parcel (Small, Medium, Large)"
     )
     parcel_description: str = Field(
         ...,
-        example="Books",
+        json_schema_extra={"example": "Books"},
         description="Description of the parcel contents"
     )
     tracking_id: str = Field(
         ...,
-        example="123456",
+        json_schema_extra={"example": "123456"},
         description="Tracking ID for the parcel"
     )
     demo_mode: Optional[bool] = Field(
         False,
-        example=True,
+        json_schema_extra={"example": True},
         description="Enable demo mode with faster notification intervals"
     )
     notification_interval: Optional[int] = Field(
         60,
-        example=10,
+        json_schema_extra={"example": 10},
         description="Seconds between notifications (default 60, demo mode: 10-20)"
     )
 
 class CouponCodeRequest(BaseModel):
     """Request to fetch a coupon code"""
-    coupon_request: bool = Field(
+    coupon_request: Literal[True] = Field(
         ...,
-        example=True,  # Changed from 'true' to True (no quotes for boolean)
+        json_schema_extra={"example": True},  # Changed from 'true' to True (no quotes for boolean)
         description="must be 'true' to request a coupon code"
     )
-    user_id: str = Field(
+    user_id: UserId = Field(
         ...,
-        example="user123",
         description="Unique identifier for the user requesting the coupon"
     )
 
 class CouponValidationRequest(BaseModel):
     """Request to validate a coupon code"""
-    coupon_code: str = Field(
+    model_config = ConfigDict(frozen=True)  # Never mutated after validation
+
+    coupon_code: CouponCode = Field(
         ...,
-        example="SAVE-A1B2C3D4",
         description="The coupon code to validate"
     )
-    user_id: str = Field(
+    user_id: UserId = Field(
         ...,
-        example="user123",
         description="User ID attempting to use the coupon"
     )
 
@@ -108,52 +115,52 @@ class CalendarDataRequest(BaseModel):
     """Request to generate calendar event from OneSignal data feed"""
     summary: str = Field(
         ...,
-        example="Booking Confirmation",
+        json_schema_extra={"example": "Booking Confirmation"},
         description="Event summary/title"
     )
     description: str = Field(
         ...,
-        example="Windglass Repair Appointment",
+        json_schema_extra={"example": "Windglass Repair Appointment"},
         description="Event description"
     )
     organizer_email: str = Field(
         ...,
-        example="claudio+1@onesignal.com",
+        json_schema_extra={"example": "claudio+1@onesignal.com"},
         description="Email of the event organizer"
     )
     attendees_emails: List[str] = Field(
         ...,
-        example=["user@example.com"],
+        json_schema_extra={"example": ["user@example.com"]},
         description="List of attendee email addresses"
     )
     time_zone: str = Field(
         ...,
-        example="Europe/Helsinki",
+        json_schema_extra={"example": "Europe/Helsinki"},
         description="Timezone for the event (IANA timezone format)"
     )
     location: str = Field(
         ...,
-        example="Workshop Name",
+        json_schema_extra={"example": "Workshop Name"},
         description="Event location"
     )
     start_time: str = Field(
         ...,
-        example="16:00",
+        json_schema_extra={"example": "16:00"},
         description="Start time in HH:MM format (24-hour)"
     )
     end_time: str = Field(
         ...,
-        example="17:00",
+        json_schema_extra={"example": "17:00"},
         description="End time in HH:MM format (24-hour)"
     )
     meeting_date: str = Field(
         ...,
-        example="25-12-2025",
+        json_schema_extra={"example": "25-12-2025"},
         description="Meeting date in DD-MM-YYYY format"
     )
     glass_type: Optional[str] = Field(
         None,
-        example="windshield",
+        json_schema_extra={"example": "windshield"},
         description="Type of glass being serviced (custom field)"
     )
 
@@ -177,24 +184,23 @@ class CouponCodeResponse(BaseModel):
     """Response containing the generated coupon code"""
     coupon_code: str = Field(
         ...,
-        example="SAVE-A1B2C3D4",
+        json_schema_extra={"example": "A1B2C3"},
         description="Unique coupon code valid for 5 minutes"
     )
     expires_at: datetime = Field(
         ...,
-        example="2024-01-20T10:30:00Z",
+        json_schema_extra={"example": "2024-01-20T10:30:00Z"},
         description="ISO timestamp when the coupon expires"
     )
-    user_id: str = Field(
+    user_id: UserId = Field(
         ...,
-        example="user123",
         description="User ID associated with this coupon"
     )
 class CouponValidationResponse(BaseModel):
     """Response for coupon validation"""
     is_valid: bool = Field(
         ...,
-        example=True,
+        json_schema_extra={"example": True},
         description="Whether the coupon is valid"
     )
 
@@ -202,17 +208,17 @@ class CalendarDataResponse(BaseModel):
     """Response containing calendar URLs"""
     status: str = Field(
         ...,
-        example="success",
+        json_schema_extra={"example": "success"},
         description="Status of the request"
     )
     google_url: Optional[str] = Field(
         None,
-        example="https://calendar.google.com/calendar/render?action=TEMPLATE&text=...",
+        json_schema_extra={"example": "https://calendar.google.com/calendar/render?action=TEMPLATE&text=..."},
         description="Google Calendar add to calendar URL"
     )
     ics_url: Optional[str] = Field(
         None,
-        example="https://your-railway-app.railway.app/calendar/appointment-123.ics",
+        json_schema_extra={"example": "https://your-railway-app.railway.app/calendar/appointment-123.ics"},
         description="URL to download .ics calendar file"
     )
     message: Optional[str] = Field(
@@ -221,55 +227,84 @@ class CalendarDataResponse(BaseModel):
     )
 
 
-class StoredOTP(BaseModel):
-    """How we store OTP data internally"""
+@dataclass(slots=True)
+class StoredOTP:
+    """How we store OTP data internally (never crosses the API, so no validation)"""
     phone_number: str
     code: str
-    created_at: datetime
+    created_at: float  # epoch seconds
     used: bool = False
 
+    def to_dict(self) -> dict:
+        """Readable dict (debug output)"""
+        return {
+            "phone_number": self.phone_number,
+            "code": self.code,
+            "created_at": self.created_at,
+            "used": self.used
+        }
+
+    def to_record(self) -> dict:
+        """Compact dict for the KV store (short keys, whole-second timestamp)"""
+        return {"pn": self.phone_number, "c": self.code, "ts": int(self.created_at), "u": self.used}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "StoredOTP":
+        """Rebuild from a to_record() dict"""
+        return cls(
+            phone_number=record["pn"],
+            code=record["c"],
+            created_at=record["ts"],
+            used=record["u"]
+        )
+
 
 class SignalPostLiveActivityRequest(BaseModel):
     """Request to start Signal Post Live Activity demo sequence"""
     tracking_number: str = Field(
         ...,
-        example="4821",
+        json_schema_extra={"example": "4821"},
         description="Parcel tracking number"
     )
     activity_id: str = Field(
         ...,
-        example="ABC123...",
+        json_schema_extra={"example": "ABC123..."},
         description="Activity.id from ActivityKit"
     )
     push_token: Optional[str] = Field(
         None,
-        example="abcdef123...",
+        json_schema_extra={"example": "abcdef123..."},
         description="Live Activity push token"
     )
     external_id: Optional[str] = Field(
         None,
-        example="YCYEL51G",
+        json_schema_extra={"example": "YCYEL51G"},
         description="OneSignal external ID"
     )
     app_id: str = Field(
         ...,
-        example="cf532c5e-...",
+        json_schema_extra={"example": "cf532c5e-..."},
         description="OneSignal App ID"
     )
 
 
 class FlightUpdateContentState(BaseModel):
-    gate: str = Field(..., example="A12", description="Gate number")
-    boardingTime: Optional[str] = Field(None, alias="boardingTime", example="2025-09-30T16:55:00Z", description="Boarding time in ISO format")
-    status: Optional[str] = Field(None, example="boarding", description="Flight status (e.g., boarding, in-flight, landed)")
-    group: Optional[str] = Field(None, example="Group A", description="Boarding group")  
+    model_config = ConfigDict(frozen=True)  # Hashable, so the parent request is too
+
+    gate: str = Field(..., json_schema_extra={"example": "A12"}, description="Gate number")
+    boardingTime: Optional[str] = Field(None, json_schema_extra={"example": "2025-09-30T16:55:00Z"}, description="Boarding time in ISO format")
+    status: Optional[str] = Field(None, json_schema_extra={"example": "boarding"}, description="Flight status (e.g., boarding, in-flight, landed)")
+    group: Optional[str] = Field(None, json_schema_extra={"example": "Group A"}, description="Boarding group")  
 
 class FlightUpdateLiveActivity(BaseModel):
-    activity_type: Literal["flightUpdate"] = Field(..., alias="activity_type")
-    activity_id: str = Field(..., alias="activity_id")
-    content_state: FlightUpdateContentState = Field(..., alias="content_state")
-    trace_id: Optional[str] = Field(None, alias="trace_id")
-    timestamp: Optional[datetime] = Field(None, alias="time_stamp")
+    model_config = ConfigDict(frozen=True)  # Never mutated after validation
+
+    activity_type: Literal["flightUpdate"]
+    activity_id: str
+    content_state: FlightUpdateContentState
+    trace_id: Optional[str] = None
+    # Clients send "time_stamp"; the field name is accepted as well
+    timestamp: Optional[datetime] = Field(None, validation_alias=AliasChoices("time_stamp", "timestamp"))
 
 
 # ==================== Webhook Models ====================
@@ -283,26 +318,26 @@ class OneSignalWebhookEvent(BaseModel):
     # Event identification
     event: str = Field(
         ...,
-        example="notification.delivered",
+        json_schema_extra={"example": "notification.delivered"},
         description="Event type (notification.sent, notification.delivered, notification.clicked, etc.)"
     )
     app_id: str = Field(
         ...,
-        example="8b9c7d6e-5f4a-4b3c-2d1e-0f9a8b7c6d5e",
+        json_schema_extra={"example": "8b9c7d6e-5f4a-4b3c-2d1e-0f9a8b7c6d5e"},
         description="OneSignal App ID"
     )
 
     # Notification details (may not be present in all events)
     notification_id: Optional[str] = Field(
         None,
-        example="f7e8d9c0-1a2b-3c4d-5e6f-7a8b9c0d1e2f",
+        json_schema_extra={"example": "f7e8d9c0-1a2b-3c4d-5e6f-7a8b9c0d1e2f"},
         description="OneSignal notification ID"
     )
 
     # User identification
     external_id: Optional[str] = Field(
         None,
-        example="YCYEL51G",
+        json_schema_extra={"example": "YCYEL51G"},
         description="User's external_id (from login)"
     )
     onesignal_id: Optional[str] = Field(
@@ -313,12 +348,12 @@ class OneSignalWebhookEvent(BaseModel):
     # Message content (for reconstructing inbox)
     headings: Optional[dict] = Field(
         None,
-        example={"en": "Package Delivered"},
+        json_schema_extra={"example": {"en": "Package Delivered"}},
         description="Notification title in different languages"
     )
     contents: Optional[dict] = Field(
         None,
-        example={"en": "Your parcel has arrived!"},
+        json_schema_extra={"example": {"en": "Your parcel has arrived!"}},
         description="Notification body in different languages"
     )
     data: Optional[dict] = Field(
@@ -344,8 +379,7 @@ class OneSignalWebhookEvent(BaseModel):
         description="When the event occurred"
     )
 
-    class Config:
-        extra = "allow"  # Allow additional fields we haven't explicitly defined
+    model_config = ConfigDict(extra="allow")  # Allow additional fields we haven't explicitly defined
 
 
 class MessageEventResponse(BaseModel):
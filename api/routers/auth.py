@@ -3,6 +3,7 @@
 Authentication router - Handles all OTP-related HTTP endpoints
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
 from ..models.schemas import (
     OTPRequest, 
     VerifyOTPRequest, 
@@ -11,6 +12,10 @@ from ..models.schemas import (
 )
 from ..services.otp_service import otp_service
 
+# Endpoints keep response_model= for the OpenAPI docs but return an ORJSONResponse
+# built from the model themselves: the responses are assembled from server-side
+# values, so FastAPI's outbound re-validation and jsonable_encoder pass is skipped.
+
 # Create a router instance (like a mini FastAPI app)
 router = APIRouter(
     prefix="/auth",  # All routes will start with /auth
@@ -21,12 +26,7 @@ router = APIRouter(
 @router.post("/otp", response_model=OTPResponse)
 async def generate_otp(request: OTPRequest):
     """Generate a 5-digit OTP for a specific phone number"""
-
-    if not request.request_otp:
-        return OTPResponse(
-            status="error",
-            message="request_otp must be 'true' to generate an OTP"
-        )
+    # request_otp is Literal[True]: anything else is rejected with 422 before we get here
 
     try:
         # Generate the OTP using our service
@@ -35,20 +35,20 @@ async def generate_otp(request: OTPRequest):
         # TODO: Send via OneSignal here
         # await onesignal_service.send_sms(request.phone_number, code)
         
-        return OTPResponse(
+        return ORJSONResponse(OTPResponse.model_construct(
             status="success",
             message=f"OTP sent to {request.phone_number}",
             signal_code=code,  
             debug="In production, don't return the code!"
-        )
+        ).model_dump())
 
     
     
     except Exception as e:
-        return OTPResponse(
+        return ORJSONResponse(OTPResponse.model_construct(
             status="error",
             message=str(e)
-        )
+        ).model_dump())
 
 
 @router.post("/verify", response_model=VerifyResponse)
@@ -61,21 +61,11 @@ async def verify_otp(request: VerifyOTPRequest):
         request.signal_code
     )
     
-    return VerifyResponse(
+    return ORJSONResponse(VerifyResponse.model_construct(
         status="success" if is_valid else "error",
         valid=is_valid,
         message=message
-    )
-
-
-@router.post("/cleanup")
-async def cleanup_otps():
-    """Manually clean up expired OTPs"""
-    count = await otp_service.cleanup_expired_otps()
-    return {
-        "status": "success",
-        "message": f"Found {count} active OTPs (expired ones auto-removed by TTL)"
-    }
+    ).model_dump())
 
 
 # Debug endpoint - remove in production
@@ -2,13 +2,19 @@
 """
 Calendar endpoints for generating Google Calendar URLs and ICS files
 """
+import logging
+import uuid
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 from api.models.schemas import CalendarDataRequest, CalendarDataResponse
 from api.services.calendar_service import calendar_service
 from api.config import settings
 
 router = APIRouter(prefix="/calendar", tags=["calendar"])
+logger = logging.getLogger(__name__)
+
+# ICS files never change once generated, so clients and CDNs may cache them
+ICS_CACHE_CONTROL = "public, max-age=86400, immutable"
 
 
 @router.post("-data", response_model=CalendarDataResponse)
@@ -35,22 +41,23 @@ async def create_calendar_event(request: CalendarDataRequest, http_request: Requ
     }
     """
     try:
-        # Build base URL from request
-        base_url = str(http_request.base_url).rstrip('/')
+        # Use the configured public URL; only derive it from the request when unset
+        base_url = settings.PUBLIC_BASE_URL or str(http_request.base_url).rstrip('/')
 
         # Generate calendar data
+        # (returned as ORJSONResponse; response_model is kept for the docs only)
         response = await calendar_service.generate_calendar_data(request, base_url)
 
-        return response
+        return ORJSONResponse(response.model_dump())
 
     except Exception as e:
-        print(f"❌ Error in calendar endpoint: {type(e).__name__}: {e}")
-        return CalendarDataResponse(
+        logger.error("❌ Error in calendar endpoint: %s: %s", type(e).__name__, e)
+        return ORJSONResponse(CalendarDataResponse.model_construct(
             status="error",
             google_url=None,
             ics_url=None,
             message=f"Failed to generate calendar data: {str(e)}"
-        )
+        ).model_dump())
 
 
 @router.get("/{event_id}.ics")
@@ -61,7 +68,26 @@ async def download_ics_file(event_id: str):
     Returns the .ics file content with proper Content-Type header
     for calendar applications to recognize and import.
     """
-    # Retrieve ICS content from storage
+    # Event IDs are UUIDs; anything else can't exist (and never reaches the filesystem)
+    try:
+        event_id = str(uuid.UUID(event_id))
+    except ValueError:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Calendar event {event_id} not found or has expired"
+        )
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{event_id}.ics"',
+        "Cache-Control": ICS_CACHE_CONTROL
+    }
+
+    # Serve the file written at generation time when this instance has it
+    ics_path = calendar_service.get_ics_path(event_id)
+    if ics_path:
+        return FileResponse(ics_path, media_type="text/calendar", headers=headers)
+
+    # Fall back to KV storage
     ics_content = await calendar_service.get_ics_content(event_id)
 
     if not ics_content:
@@ -74,7 +100,5 @@ async def download_ics_file(event_id: str):
     return Response(
         content=ics_content,
         media_type="text/calendar",
-        headers={
-            "Content-Disposition": f'attachment; filename="{event_id}.ics"'
-        }
+        headers=headers
     )
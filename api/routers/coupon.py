@@ -2,37 +2,32 @@
 """
 Coupon endpoints for generating and validating discount codes
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
 from api.models.schemas import (
     CouponCodeRequest, 
     CouponCodeResponse,
     CouponValidationRequest,
     CouponValidationResponse
 )
-from api.services.coupon_service import CouponService
+from api.services.coupon_service import coupon_service
 from api.config import settings
 
 router = APIRouter(prefix="/coupon", tags=["coupon"])
 settings = settings
 
-# Initialize the service
-coupon_service = CouponService()
-
 @router.post("/request", response_model=CouponCodeResponse)
 async def request_coupon(request: CouponCodeRequest):
     """Generate a new coupon code valid for 5 minutes"""
     
-    # Validate the coupon_request flag
-    if not request.coupon_request:
-        raise HTTPException(
-            status_code=400,
-            detail="coupon_request must be true"
-        )
+    # coupon_request is Literal[True], so a false flag never reaches this handler
     
     # Call the service to generate the coupon
-    return await coupon_service.generate_coupon(
+    # (returned as ORJSONResponse; response_model is kept for the docs only)
+    coupon = await coupon_service.generate_coupon(
         user_id=request.user_id
     )
+    return ORJSONResponse(coupon.model_dump())
 
 @router.post("/validate", response_model=CouponValidationResponse)
 async def validate_coupon(request: CouponValidationRequest):
@@ -44,4 +39,4 @@ async def validate_coupon(request: CouponValidationRequest):
         user_id=request.user_id
     )
     
-    return CouponValidationResponse(is_valid=is_valid)
\ No newline at end of file
+    return ORJSONResponse(CouponValidationResponse.model_construct(is_valid=is_valid).model_dump())
\ No newline at end of file
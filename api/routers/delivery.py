@@ -2,6 +2,7 @@
 """
 Delivery router - Handles package tracking demonstration
 """
+import logging
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
 
@@ -13,19 +14,15 @@ router = APIRouter(
     prefix="/delivery",
     tags=["delivery"]       
 )
+logger = logging.getLogger(__name__)
+
 @router.post("")
 async def track_delivery(request: DeliveryRequest):
     """Starts the parcel delivery process"""
-    
-    if not request.send_parcel:
-        return {
-            "status": "error",
-            "message": "send_parcel must be 'true' to start delivery"
-        }
-        print(f"📦 Delivery request received for tracking_id: {request.tracking_id}")  # ADD THIS
+    # send_parcel is Literal[True], so a false flag is rejected with 422 during validation
     
     # Call the service
     result = await delivery_service.schedule_delivery_sequence(request)  
-    print(f"📦 Service response: {result}")  # ADD THIS
+    logger.info("📦 Service response: %s", result)
     
     return result
\ No newline at end of file
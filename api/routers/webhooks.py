@@ -3,19 +3,45 @@
 Webhook endpoints for receiving OneSignal events.
 These endpoints store notification events for inbox reconstruction.
 """
+import logging
 from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import ORJSONResponse
 from typing import Optional
-from datetime import datetime, timedelta
-from sqlalchemy import select, and_, desc
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, and_, desc
+import orjson
 
-from ..models.schemas import OneSignalWebhookEvent, MessagesResponse, MessageEventResponse
-from ..models.database import MessageEvent
+from ..models.schemas import OneSignalWebhookEvent, MessagesResponse
+from ..models.database import MessageEvent, uuid7
 from ..services.database_service import database_service
 
 router = APIRouter(tags=["Webhooks"])
-
-
-@router.post("/webhooks/onesignal")
+logger = logging.getLogger(__name__)
+
+# Handlers return ORJSONResponse themselves so FastAPI doesn't run
+# jsonable_encoder (and response_model validation) over every payload.
+
+# Columns returned by the inbox endpoint.
+# Selecting columns (instead of the MessageEvent entity) returns plain rows
+# and skips ORM object hydration and identity-map bookkeeping per event.
+INBOX_COLUMNS = (
+    MessageEvent.id,
+    MessageEvent.event_type,
+    MessageEvent.notification_id,
+    MessageEvent.message_contents,
+    MessageEvent.created_at,
+)
+
+# Column sizes, read from the model: a webhook row that doesn't fit is rejected
+# up front instead of failing the COPY of the batch it lands in
+_COLUMNS = MessageEvent.__table__.c
+MAX_APP_ID = _COLUMNS.app_id.type.length
+MAX_EXTERNAL_ID = _COLUMNS.external_id.type.length
+MAX_EVENT_TYPE = _COLUMNS.event_type.type.length
+MAX_NOTIFICATION_ID = _COLUMNS.notification_id.type.length
+
+
+@router.post("/webhooks/onesignal", status_code=202)
 async def receive_onesignal_webhook(request: Request):
     """
     Receive and store OneSignal webhook events.
@@ -48,15 +74,16 @@ async def receive_onesignal_webhook(request: Request):
     """
     # Check if database is available
     if not database_service.is_initialized:
-        print("⚠️ Webhook received but database not initialized - event discarded")
-        return {
+        logger.warning("⚠️ Webhook received but database not initialized - event discarded")
+        return ORJSONResponse({
             "status": "warning",
             "message": "Webhook received but storage not configured"
-        }
+        })
 
     try:
-        # Parse the raw JSON payload
-        payload = await request.json()
+        # Parse the raw JSON payload (orjson is several times faster than stdlib json)
+        body = await request.body()
+        payload = orjson.loads(body)
 
         # Extract nested objects from OneSignal's webhook template format
         event_data = payload.get("Event Data", {})
@@ -74,16 +101,33 @@ async def receive_onesignal_webhook(request: Request):
         # Extract notification ID from Message Data
         notification_id = message_data.get("message.id")
 
-        print(f"📥 Webhook received: {event_type} for app {app_id} (user: {external_id})")
+        logger.debug("📥 Webhook received: %s for app %s (user: %s)", event_type, app_id, external_id)
 
         # Validate required fields
         if not event_type or not app_id:
-            print(f"⚠️ Webhook missing required fields: event.kind={event_type}, event.app_id={app_id}")
-            print(f"   Raw payload: {payload}")
-            return {
+            logger.warning("⚠️ Webhook missing required fields: event.kind=%s, event.app_id=%s", event_type, app_id)
+            logger.debug("   Raw payload: %s", payload)
+            return ORJSONResponse({
                 "status": "error",
                 "message": "Missing required fields: event.kind and event.app_id"
-            }
+            })
+
+        # Make the row fit the table (see the column limits above)
+        if notification_id is not None:
+            notification_id = str(notification_id)
+        if (
+            not isinstance(event_type, str) or len(event_type) > MAX_EVENT_TYPE
+            or not isinstance(app_id, str) or len(app_id) > MAX_APP_ID
+            or (notification_id is not None and len(notification_id) > MAX_NOTIFICATION_ID)
+        ):
+            logger.warning("⚠️ Webhook fields don't fit: event.kind=%r, event.app_id=%r, message.id=%r",
+                           event_type, app_id, notification_id)
+            return ORJSONResponse({
+                "status": "error",
+                "message": "Invalid fields: event.kind, event.app_id or message.id too long or not a string"
+            })
+        # external_id is free-form: stringified and cut to the column size
+        external_id = str(external_id)[:MAX_EXTERNAL_ID] if external_id else None
 
         # Extract message contents for inbox reconstruction
         message_contents = {}
@@ -140,31 +184,39 @@ async def receive_onesignal_webhook(request: Request):
         if event_datetime:
             message_contents["event_datetime"] = event_datetime
 
-        # Create the database record
-        async with database_service.session_factory() as session:
-            event = MessageEvent(
-                app_id=app_id,
-                external_id=external_id or "unknown",
-                event_type=event_type,
-                notification_id=notification_id,
-                message_contents=message_contents if message_contents else None,
-                event_payload=payload  # Store full payload for debugging/flexibility
-            )
-            session.add(event)
-            await session.commit()
+        # Queue the database record; the background writer stores it with COPY
+        event_id = uuid7()
+        queued = database_service.enqueue_event((
+            event_id,
+            app_id,
+            external_id or "unknown",
+            event_type,
+            notification_id,
+            orjson.dumps(message_contents).decode() if message_contents else None,
+            body.decode(),  # Store full payload as received (jsonb parses the text itself)
+            datetime.now(timezone.utc)  # Receive time (a COPY batch would share one now())
+        ))
+        if not queued:
+            # Postgres is falling behind: refuse the event so OneSignal retries it later
+            logger.error("❌ Webhook queue full - event %s for user %s rejected", event_type, external_id)
+            return ORJSONResponse({
+                "status": "error",
+                "message": "Event queue full, retry later"
+            }, status_code=503)
 
-            print(f"✅ Stored event: {event_type} for user {external_id} (notification: {notification_id})")
+        logger.info("📨 Queued event: %s for user %s (notification: %s)", event_type, external_id, notification_id)
 
-        return {
+        # 202: the event is accepted but only written once the current batch flushes
+        return ORJSONResponse({
             "status": "success",
-            "message": f"Event {event_type} stored successfully",
-            "event_id": str(event.id),
+            "message": f"Event {event_type} queued for storage",
+            "event_id": str(event_id),
             "app_id": app_id,
             "external_id": external_id
-        }
+        }, status_code=202)
 
     except Exception as e:
-        print(f"❌ Error processing webhook: {e}")
+        logger.error("❌ Error processing webhook: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
 
 
@@ -204,9 +256,11 @@ async def get_user_messages(
         )
 
     try:
-        async with database_service.session_factory() as session:
+        # Read-only Core query on a plain connection: no ORM Session, unit of work
+        # or identity map is set up for the inbox read
+        async with database_service.engine.connect() as conn:
             # Build the query
-            query = select(MessageEvent).where(
+            query = select(*INBOX_COLUMNS).where(
                 and_(
                     MessageEvent.app_id == app_id,
                     MessageEvent.external_id == external_id
@@ -220,39 +274,40 @@ async def get_user_messages(
 
             # Filter by date if specified
             if since_days:
-                cutoff = datetime.utcnow() - timedelta(days=since_days)
+                cutoff = datetime.now(timezone.utc) - timedelta(days=since_days)
                 query = query.where(MessageEvent.created_at >= cutoff)
 
             # Order by newest first and apply limit
             query = query.order_by(desc(MessageEvent.created_at)).limit(limit)
 
             # Execute query
-            result = await session.execute(query)
-            events = result.scalars().all()
+            result = await conn.execute(query)
+            rows = result.all()
 
-            # Convert to response format
+            # Convert to response format (plain dicts in the MessageEventResponse shape;
+            # the rows come straight from our own table, so there's nothing to validate)
             messages = [
-                MessageEventResponse(
-                    id=str(event.id),
-                    event_type=event.event_type,
-                    notification_id=event.notification_id,
-                    message_contents=event.message_contents,
-                    created_at=event.created_at.isoformat() if event.created_at else None
-                )
-                for event in events
+                {
+                    "id": str(row.id),
+                    "event_type": row.event_type,
+                    "notification_id": row.notification_id,
+                    "message_contents": row.message_contents,
+                    "created_at": row.created_at.isoformat() if row.created_at else None
+                }
+                for row in rows
             ]
 
-            print(f"📤 Returning {len(messages)} messages for {external_id} in app {app_id}")
+            logger.info("📤 Returning %d messages for %s in app %s", len(messages), external_id, app_id)
 
-            return MessagesResponse(
-                app_id=app_id,
-                external_id=external_id,
-                message_count=len(messages),
-                messages=messages
-            )
+            return ORJSONResponse({
+                "app_id": app_id,
+                "external_id": external_id,
+                "message_count": len(messages),
+                "messages": messages
+            })
 
     except Exception as e:
-        print(f"❌ Error retrieving messages: {e}")
+        logger.error("❌ Error retrieving messages: %s", e)
         raise HTTPException(status_code=500, detail=f"Error retrieving messages: {str(e)}")
 
 
@@ -277,33 +332,29 @@ async def delete_user_messages(
 
     try:
         async with database_service.session_factory() as session:
-            # Delete matching records
+            # Delete matching records in a single statement
             result = await session.execute(
-                select(MessageEvent).where(
+                delete(MessageEvent).where(
                     and_(
                         MessageEvent.app_id == app_id,
                         MessageEvent.external_id == external_id
                     )
                 )
             )
-            events = result.scalars().all()
-
-            for event in events:
-                await session.delete(event)
-
             await session.commit()
+            deleted_count = result.rowcount
 
-            print(f"🗑️ Deleted {len(events)} messages for {external_id} in app {app_id}")
+            logger.info("🗑️ Deleted %d messages for %s in app %s", deleted_count, external_id, app_id)
 
-            return {
+            return ORJSONResponse({
                 "status": "success",
-                "message": f"Deleted {len(events)} messages",
+                "message": f"Deleted {deleted_count} messages",
                 "app_id": app_id,
                 "external_id": external_id
-            }
+            })
 
     except Exception as e:
-        print(f"❌ Error deleting messages: {e}")
+        logger.error("❌ Error deleting messages: %s", e)
         raise HTTPException(status_code=500, detail=f"Error deleting messages: {str(e)}")
 
 
@@ -318,8 +369,8 @@ async def webhook_health():
     """
     db_health = await database_service.health_check()
 
-    return {
+    return ORJSONResponse({
         "webhook_endpoint": "healthy",
         "database": db_health,
         "message": "Webhook system operational" if db_health["status"] == "healthy" else "Webhook system degraded"
-    }
+    })
@@ -2,20 +2,91 @@
 """
 Service for generating calendar events and links
 """
+import logging
+import tempfile
+import time
 import uuid
 from datetime import datetime
-from urllib.parse import urlencode
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote_plus
 from typing import Dict, Optional
 import pytz
-from icalendar import Calendar, Event, vCalAddress, vText
-from api.storage.kv_store import KVStore
+from api.storage.kv_store import kv_store
 from api.models.schemas import CalendarDataRequest, CalendarDataResponse
 from api.config import settings
 
+logger = logging.getLogger(__name__)
+
+# ICS files are immutable once generated, so they are also written here and
+# served straight from disk. The directory is per-instance and lost on
+# redeploy; KV stays the source of truth.
+ICS_DIR = Path(tempfile.gettempdir()) / "onesignal-ics"
+
+# Google Calendar "add event" link; only the per-event fields are escaped per call
+_GCAL_BASE = "https://calendar.google.com/calendar/render?action=TEMPLATE"
+
+
+# RFC 5545 layout of the single-event calendars we publish (same properties,
+# order and parameters icalendar used to emit for us)
+_ICS_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//OneSignal Calendar Integration//EN\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "METHOD:PUBLISH\r\n"
+    "BEGIN:VEVENT\r\n"
+)
+_ICS_FOOTER = "END:VEVENT\r\nEND:VCALENDAR\r\n"
+_ATTENDEE_TEMPLATE = "ATTENDEE;CN={cn};PARTSTAT=NEEDS-ACTION;ROLE=REQ-PARTICIPANT;RSVP=TRUE:MAILTO:{email}"
+
+
+def _ics_escape(value: str) -> str:
+    """Escape a TEXT value (RFC 5545 section 3.3.11)"""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_param(value: str) -> str:
+    """Quote a parameter value if it contains characters that would end it"""
+    value = value.replace('"', "")
+    return f'"{value}"' if any(c in value for c in ":;,") else value
+
+
+def _ics_fold(line: str) -> str:
+    """Fold a content line at 75 octets (RFC 5545 section 3.1), without splitting UTF-8 characters"""
+    if len(line) <= 75 and line.isascii():
+        return line + "\r\n"
+    parts = []
+    current, size, limit = [], 0, 75
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > limit:
+            parts.append("".join(current))
+            current, size, limit = [], 0, 74  # continuation lines start with a space
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+_UTC = pytz.UTC
+
+
+@lru_cache(maxsize=256)
+def _get_tz(name: str):
+    """Resolve an IANA timezone once; requests only ever use a handful of zones"""
+    return pytz.timezone(name)
+
 
 class CalendarService:
     def __init__(self):
-        self.kv_store = KVStore()
+        self.kv_store = kv_store
         self.settings = settings
         self.ics_ttl = 30 * 24 * 60 * 60  # 30 days in seconds
 
@@ -31,7 +102,7 @@ class CalendarService:
             CalendarDataResponse with google_url and ics_url
         """
         try:
-            print(f"📅 Generating calendar data for: {request.summary}")
+            logger.debug("📅 Generating calendar data for: %s", request.summary)
 
             # 1. Parse date and time
             start_dt, end_dt = self._parse_datetime(
@@ -55,30 +126,33 @@ class CalendarService:
             )
 
             # 5. Store ICS content in KV store
-            self.kv_store.set(
+            await self.kv_store.set(
                 key=f"calendar_ics:{event_id}",
                 value={
                     "ics_content": ics_content,
-                    "created_at": datetime.utcnow().isoformat()
+                    "created_at": time.time()  # epoch seconds
                 },
                 ttl=self.ics_ttl
             )
 
-            # 6. Build ICS URL
+            # 6. Keep a copy on disk for the download endpoint
+            self._write_ics_file(event_id, ics_content)
+
+            # 7. Build ICS URL
             ics_url = f"{base_url}/calendar/{event_id}.ics"
 
-            print(f"✅ Calendar data generated successfully: {event_id}")
+            logger.debug("✅ Calendar data generated successfully: %s", event_id)
 
-            return CalendarDataResponse(
+            return CalendarDataResponse.model_construct(
                 status="success",
                 google_url=google_url,
                 ics_url=ics_url
             )
 
         except Exception as e:
-            print(f"❌ Error generating calendar data: {type(e).__name__}: {e}")
+            logger.error("❌ Error generating calendar data: %s: %s", type(e).__name__, e)
             # Return partial success if possible
-            return CalendarDataResponse(
+            return CalendarDataResponse.model_construct(
                 status="error",
                 google_url=None,
                 ics_url=None,
@@ -104,28 +178,16 @@ class CalendarService:
         Returns:
             Tuple of (start_datetime, end_datetime) as timezone-aware objects
         """
-        # Parse date (DD-MM-YYYY)
-        day, month, year = meeting_date.split('-')
-
-        # Parse start time (HH:MM)
-        start_hour, start_minute = start_time.split(':')
-
-        # Parse end time (HH:MM)
-        end_hour, end_minute = end_time.split(':')
-
         # Get timezone
-        tz = pytz.timezone(timezone_str)
+        tz = _get_tz(timezone_str)
 
-        # Create datetime objects
-        start_dt = tz.localize(datetime(
-            int(year), int(month), int(day),
-            int(start_hour), int(start_minute), 0
-        ))
+        # Parse date (DD-MM-YYYY) and time (HH:MM) together
+        naive_start = datetime.strptime(f"{meeting_date} {start_time}", "%d-%m-%Y %H:%M")
+        naive_end = datetime.strptime(f"{meeting_date} {end_time}", "%d-%m-%Y %H:%M")
 
-        end_dt = tz.localize(datetime(
-            int(year), int(month), int(day),
-            int(end_hour), int(end_minute), 0
-        ))
+        # Create timezone-aware datetime objects
+        start_dt = tz.localize(naive_start)
+        end_dt = tz.localize(naive_end)
 
         return start_dt, end_dt
 
@@ -147,11 +209,16 @@ class CalendarService:
             Google Calendar URL
         """
         # Format dates for Google Calendar (YYYYMMDDTHHmmssZ in UTC)
-        start_utc = start_dt.astimezone(pytz.UTC)
-        end_utc = end_dt.astimezone(pytz.UTC)
+        start_utc = start_dt.astimezone(_UTC)
+        end_utc = end_dt.astimezone(_UTC)
 
-        # Format: 20251225T140000Z
-        dates_str = f"{start_utc.strftime('%Y%m%dT%H%M%SZ')}/{end_utc.strftime('%Y%m%dT%H%M%SZ')}"
+        # Format: 20251225T140000Z ("/" between start and end is sent escaped)
+        dates_str = (
+            f"{start_utc.year:04d}{start_utc.month:02d}{start_utc.day:02d}"
+            f"T{start_utc.hour:02d}{start_utc.minute:02d}{start_utc.second:02d}Z%2F"
+            f"{end_utc.year:04d}{end_utc.month:02d}{end_utc.day:02d}"
+            f"T{end_utc.hour:02d}{end_utc.minute:02d}{end_utc.second:02d}Z"
+        )
 
         # Build description with additional details
         description_parts = [request.description]
@@ -160,25 +227,21 @@ class CalendarService:
         description_parts.append(f"Organizer: {request.organizer_email}")
         full_description = "\n".join(description_parts)
 
-        # Build query parameters
-        params = {
-            'action': 'TEMPLATE',
-            'text': request.summary,
-            'dates': dates_str,
-            'details': full_description,
-            'location': request.location,
-            'ctz': request.time_zone
-        }
+        # Build the URL (same encoding urlencode would apply to each value)
+        url = (
+            f"{_GCAL_BASE}"
+            f"&text={quote_plus(request.summary)}"
+            f"&dates={dates_str}"
+            f"&details={quote_plus(full_description)}"
+            f"&location={quote_plus(request.location)}"
+            f"&ctz={quote_plus(request.time_zone)}"
+        )
 
         # Add attendees if present (comma-separated)
         if request.attendees_emails:
-            params['add'] = ','.join(request.attendees_emails)
+            url += f"&add={quote_plus(','.join(request.attendees_emails))}"
 
-        # Generate URL
-        base_url = "https://calendar.google.com/calendar/render"
-        query_string = urlencode(params)
-
-        return f"{base_url}?{query_string}"
+        return url
 
     def _generate_ics_content(
         self,
@@ -199,49 +262,58 @@ class CalendarService:
         Returns:
             ICS file content as string
         """
-        # Create calendar
-        cal = Calendar()
-        cal.add('prodid', '-//OneSignal Calendar Integration//EN')
-        cal.add('version', '2.0')
-        cal.add('calscale', 'GREGORIAN')
-        cal.add('method', 'PUBLISH')
-
-        # Create event
-        event = Event()
-        event.add('uid', f'{event_id}@onesignal-calendar')
-        event.add('dtstamp', datetime.utcnow())
-        event.add('dtstart', start_dt)
-        event.add('dtend', end_dt)
-        event.add('summary', request.summary)
-
-        # Add description with custom fields
+        # Times are written in the request's timezone with a TZID parameter
+        tzid = _ics_param(request.time_zone)
+
+        # Description with custom fields
         description_parts = [request.description]
         if request.glass_type:
             description_parts.append(f"Glass Type: {request.glass_type}")
-        event.add('description', '\n'.join(description_parts))
-
-        # Add location
-        event.add('location', request.location)
-
-        # Add organizer
-        organizer = vCalAddress(f'MAILTO:{request.organizer_email}')
-        organizer.params['cn'] = vText(request.organizer_email)
-        event.add('organizer', organizer)
+        description = "\n".join(description_parts)
+
+        lines = [
+            f"SUMMARY:{_ics_escape(request.summary)}",
+            f"DTSTART;TZID={tzid}:{start_dt.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND;TZID={tzid}:{end_dt.strftime('%Y%m%dT%H%M%S')}",
+            f"DTSTAMP:{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}",
+            f"UID:{event_id}@onesignal-calendar",
+        ]
+        lines.extend(
+            _ATTENDEE_TEMPLATE.format(cn=_ics_param(email), email=email)
+            for email in request.attendees_emails
+        )
+        lines.append(f"DESCRIPTION:{_ics_escape(description)}")
+        lines.append(f"LOCATION:{_ics_escape(request.location)}")
+        organizer = request.organizer_email
+        lines.append(f"ORGANIZER;CN={_ics_param(organizer)}:MAILTO:{organizer}")
+
+        return _ICS_HEADER + "".join(map(_ics_fold, lines)) + _ICS_FOOTER
+
+    def _write_ics_file(self, event_id: str, ics_content: str) -> None:
+        """Write ICS content to the on-disk cache (best effort)"""
+        try:
+            ICS_DIR.mkdir(parents=True, exist_ok=True)
+            (ICS_DIR / f"{event_id}.ics").write_text(ics_content, encoding="utf-8")
+        except OSError as e:
+            logger.warning("⚠️ Could not cache ICS file on disk: %s: %s", type(e).__name__, e)
 
-        # Add attendees
-        for attendee_email in request.attendees_emails:
-            attendee = vCalAddress(f'MAILTO:{attendee_email}')
-            attendee.params['cn'] = vText(attendee_email)
-            attendee.params['ROLE'] = vText('REQ-PARTICIPANT')
-            attendee.params['PARTSTAT'] = vText('NEEDS-ACTION')
-            attendee.params['RSVP'] = vText('TRUE')
-            event.add('attendee', attendee)
+    def get_ics_path(self, event_id: str) -> Optional[Path]:
+        """
+        Get the cached ICS file for an event, if present and not expired
 
-        # Add event to calendar
-        cal.add_component(event)
+        Args:
+            event_id: Unique event identifier (must already be a validated UUID)
 
-        # Return as string
-        return cal.to_ical().decode('utf-8')
+        Returns:
+            Path to the file or None
+        """
+        path = ICS_DIR / f"{event_id}.ics"
+        try:
+            if path.stat().st_mtime + self.ics_ttl > time.time():
+                return path
+        except OSError:
+            pass
+        return None
 
     async def get_ics_content(self, event_id: str) -> Optional[str]:
         """
@@ -254,15 +326,19 @@ class CalendarService:
             ICS file content or None if not found
         """
         try:
-            data = self.kv_store.get(f"calendar_ics:{event_id}")
+            data = await self.kv_store.get(f"calendar_ics:{event_id}")
             if data:
-                print(f"📅 Retrieved ICS content for event: {event_id}")
-                return data.get("ics_content")
+                logger.debug("📅 Retrieved ICS content for event: %s", event_id)
+                ics_content = data.get("ics_content")
+                if ics_content:
+                    # Repopulate the disk cache (e.g. after a redeploy)
+                    self._write_ics_file(event_id, ics_content)
+                return ics_content
             else:
-                print(f"❌ ICS content not found for event: {event_id}")
+                logger.info("❌ ICS content not found for event: %s", event_id)
                 return None
         except Exception as e:
-            print(f"❌ Error retrieving ICS content: {type(e).__name__}: {e}")
+            logger.error("❌ Error retrieving ICS content: %s: %s", type(e).__name__, e)
             return None
 
 
@@ -2,16 +2,34 @@
 """
 Service for generating and validating coupon codes
 """
-import random
+import secrets
 import string
-from datetime import datetime, timedelta
-from api.storage.kv_store import KVStore
+import time
+from datetime import datetime, timezone
+from api.storage.kv_store import kv_store
 from api.models.schemas import CouponCodeResponse
 from api.config import settings
 
+# Characters a coupon code is drawn from (matches the CouponCode pattern)
+_ALPHABET = string.ascii_uppercase + string.digits
+
+def _expiry_epoch(expires_at) -> float:
+    """
+    A stored expires_at as epoch seconds.
+    Coupons written before the switch to epoch timestamps hold a naive UTC ISO
+    string; they're still around until their 5-minute TTL runs out.
+    """
+    if isinstance(expires_at, str):
+        parsed = datetime.fromisoformat(expires_at)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return expires_at
+
+
 class CouponService:
     def __init__(self):
-        self.kv_store = KVStore()
+        self.kv_store = kv_store
         self.settings = settings
         self.expiry_minutes = 5
     
@@ -21,34 +39,36 @@ class CouponService:
         # 1. Generate a unique code
         coupon_code = self._generate_unique_code()
         
-        # 2. Calculate expiry time
-        expires_at = datetime.utcnow() + timedelta(minutes=self.expiry_minutes)
-        
-        # 3. Store in KV with the coupon code as key
-        self.kv_store.set(
-            key=f"coupon:{coupon_code}",
-            value={
-                "user_id": user_id,
-                "expires_at": expires_at.isoformat(),
-                "used": False
-            },
-            ttl=self.expiry_minutes * 60  # Convert to seconds
-        )
+        # 2. Calculate expiry time (epoch seconds; converted to a datetime only for the response)
+        ttl = self.expiry_minutes * 60  # Convert to seconds
+        expires_at = time.time() + ttl
         
-        # 4. Also store by user_id to track their coupons
-        self.kv_store.set(
-            key=f"user_coupon:{user_id}",
-            value={
-                "coupon_code": coupon_code,
-                "expires_at": expires_at.isoformat()
-            },
-            ttl=self.expiry_minutes * 60
-        )
+        # 3. Store the coupon by code, and by user_id to track their coupons,
+        #    in a single round-trip
+        await self.kv_store.set_many([
+            (
+                f"coupon:{coupon_code}",
+                {
+                    "user_id": user_id,
+                    "expires_at": expires_at,
+                    "used": False
+                },
+                ttl
+            ),
+            (
+                f"user_coupon:{user_id}",
+                {
+                    "coupon_code": coupon_code,
+                    "expires_at": expires_at
+                },
+                ttl
+            ),
+        ])
         
-        # 5. Return the response
-        return CouponCodeResponse(
+        # 4. Return the response
+        return CouponCodeResponse.model_construct(
             coupon_code=coupon_code,
-            expires_at=expires_at,
+            expires_at=datetime.fromtimestamp(expires_at, timezone.utc),
             user_id=user_id
         )
     
@@ -56,7 +76,7 @@ class CouponService:
         """Check if a coupon is valid for the given user"""
         
         # 1. Retrieve coupon from KV store
-        coupon_data = self.kv_store.get(f"coupon:{coupon_code}")
+        coupon_data = await self.kv_store.get(f"coupon:{coupon_code}")
         
         # 2. Check if coupon exists
         if not coupon_data:
@@ -71,8 +91,7 @@ class CouponService:
             return False
         
         # 5. Check if expired (belt and suspenders - KV TTL should handle this)
-        expires_at = datetime.fromisoformat(coupon_data.get("expires_at"))
-        if datetime.utcnow() > expires_at:
+        if time.time() > _expiry_epoch(coupon_data.get("expires_at", 0)):
             return False
         
         # 6. Mark as used (optional - depends on your business logic)
@@ -87,7 +106,9 @@ class CouponService:
         return True
     
     def _generate_unique_code(self) -> str:
-        """Generate a random 6-character coupon code"""
-        return ''.join(
-            random.choices(string.ascii_uppercase + string.digits, k=6)
-        )
\ No newline at end of file
+        """Generate a random 6-character coupon code (CSPRNG, codes gate redemptions)"""
+        return ''.join(secrets.choice(_ALPHABET) for _ in range(6))
+
+
+# Create a single instance to use across the app
+coupon_service = CouponService()
\ No newline at end of file
@@ -3,15 +3,31 @@
 Database connection and initialization service
 Handles async Postgres connections using SQLAlchemy
 """
-import os
+import asyncio
+import logging
 from typing import Optional, AsyncGenerator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy import text
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from ..models.database import Base, MessageEvent
 from ..config import settings
 
+# Webhook events are written in batches with COPY: a batch is flushed once it
+# holds EVENT_BATCH_SIZE rows or EVENT_FLUSH_INTERVAL seconds after its first row
+EVENT_BATCH_SIZE = 500
+EVENT_FLUSH_INTERVAL = 0.1
+EVENT_COLUMNS = ("id", "app_id", "external_id", "event_type", "notification_id", "message_contents", "event_payload", "created_at")
+# Most events waiting to be written; past this enqueue_event() refuses new ones
+# (the webhook answers 503 and OneSignal retries) instead of growing without bound
+EVENT_QUEUE_MAX = 10_000
+
+logger = logging.getLogger(__name__)
+
+# Statements run on every cleanup / health check, built once
+_DELETE_OLD = text("DELETE FROM message_events WHERE created_at < :cutoff")
+_HEALTH_PING = text("SELECT 1")
+
 
 class DatabaseService:
     """
@@ -33,14 +49,16 @@ class DatabaseService:
         self.engine = None
         self.session_factory = None
         self._initialized = False
+        self._event_queue: Optional[asyncio.Queue] = None
+        self._event_writer_task: Optional[asyncio.Task] = None
+        self.database_url = self._normalize_url(settings.DATABASE_URL)
 
-    @property
-    def database_url(self) -> Optional[str]:
+    @staticmethod
+    def _normalize_url(url: Optional[str]) -> Optional[str]:
         """
-        Get the database URL from environment variables.
+        Adapt the DATABASE_URL from settings for asyncpg.
         Railway provides DATABASE_URL automatically when you add Postgres.
         """
-        url = os.getenv("DATABASE_URL")
         if url:
             # Railway/Heroku use postgres:// but asyncpg needs postgresql+asyncpg://
             if url.startswith("postgres://"):
@@ -68,19 +86,28 @@ class DatabaseService:
             True if initialization successful, False otherwise
         """
         if not self.is_configured:
-            print("⚠️ DATABASE_URL not configured - webhook storage disabled")
+            logger.warning("⚠️ DATABASE_URL not configured - webhook storage disabled")
             return False
 
         try:
-            print(f"🔌 Connecting to Postgres...")
+            logger.info("🔌 Connecting to Postgres...")
 
             # Create async engine
             self.engine = create_async_engine(
                 self.database_url,
                 echo=settings.is_development,  # Log SQL in development
-                pool_size=5,
-                max_overflow=10,
-                pool_pre_ping=True  # Verify connections before use
+                pool_size=settings.DB_POOL_SIZE,  # Per worker process (see config)
+                max_overflow=settings.DB_MAX_OVERFLOW,
+                pool_recycle=1800,  # Replace connections older than 30 minutes
+                pool_timeout=30,  # Seconds to wait for a free connection before erroring
+                pool_pre_ping=True,  # Verify connections before use
+                connect_args={
+                    # Reuse server-side prepared statements for the repeated inbox/webhook queries
+                    "prepared_statement_cache_size": 512,
+                    "statement_cache_size": 1024,
+                    # Short OLTP queries never benefit from JIT, only pay its planning cost
+                    "server_settings": {"jit": "off"},
+                }
             )
 
             # Create session factory
@@ -94,23 +121,131 @@ class DatabaseService:
             async with self.engine.begin() as conn:
                 await conn.run_sync(Base.metadata.create_all)
 
+            await self._enable_payload_compression()
+
+            # Start the background writer for webhook events
+            self._event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAX)
+            self._event_writer_task = asyncio.create_task(self._event_writer())
+
             self._initialized = True
-            print("✅ Database initialized successfully")
+            logger.info("✅ Database initialized successfully")
             return True
 
         except Exception as e:
-            print(f"❌ Database initialization failed: {e}")
+            logger.error("❌ Database initialization failed: %s", e)
             self._initialized = False
             return False
 
+    async def _enable_payload_compression(self) -> None:
+        """
+        Compress the (large, repetitive) webhook payload column with LZ4
+        instead of the default pglz, which is cheaper to decompress on reads.
+
+        Needs Postgres 14+ built with lz4; otherwise it is skipped.
+        Only values written after the change are compressed with LZ4.
+        """
+        try:
+            async with self.engine.begin() as conn:
+                current = await conn.scalar(text(
+                    "SELECT attcompression FROM pg_attribute "
+                    "WHERE attrelid = 'message_events'::regclass AND attname = 'event_payload'"
+                ))
+                if current != "l":
+                    await conn.execute(text(
+                        "ALTER TABLE message_events ALTER COLUMN event_payload SET COMPRESSION lz4"
+                    ))
+                    logger.info("🗜️ LZ4 compression enabled for event_payload")
+        except Exception as e:
+            logger.info("ℹ️ LZ4 compression not available, keeping default: %s", type(e).__name__)
+
+    def enqueue_event(self, record: tuple) -> bool:
+        """
+        Queue a webhook event row for the background COPY writer.
+
+        Args:
+            record: Values in EVENT_COLUMNS order (JSONB columns as JSON strings)
+
+        Returns:
+            False if the queue is full (Postgres is falling behind) and the row was not queued
+        """
+        try:
+            self._event_queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _event_writer(self):
+        """Drain the event queue in batches until shutdown() sends the None sentinel."""
+        loop = asyncio.get_running_loop()
+        running = True
+        while running:
+            record = await self._event_queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + EVENT_FLUSH_INTERVAL
+
+            while len(batch) < EVENT_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._event_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    running = False
+                    break
+                batch.append(record)
+
+            await self._copy_events(batch)
+
+    async def _copy_events(self, batch: list):
+        """
+        Write a batch of event rows with a single binary COPY.
+
+        A COPY is all-or-nothing, so if the batch fails it is written again
+        row by row: one bad row only loses itself, not the whole batch.
+        """
+        try:
+            async with self.engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                try:
+                    await raw.copy_records_to_table("message_events", records=batch, columns=EVENT_COLUMNS)
+                    logger.debug("✅ Stored %d webhook event(s)", len(batch))
+                    return
+                except Exception as e:
+                    logger.warning("⚠️ COPY of %d webhook event(s) failed (%s: %s), retrying row by row",
+                                   len(batch), type(e).__name__, e)
+
+                failed = 0
+                for record in batch:
+                    try:
+                        await raw.copy_records_to_table("message_events", records=[record], columns=EVENT_COLUMNS)
+                    except Exception as e:
+                        failed += 1
+                        logger.error("❌ Dropped webhook event %s: %s: %s", record[0], type(e).__name__, e)
+                if failed:
+                    logger.error("❌ Failed to store %d of %d webhook event(s)", failed, len(batch))
+                else:
+                    logger.debug("✅ Stored %d webhook event(s) row by row", len(batch))
+        except Exception as e:
+            logger.error("❌ Failed to store %d webhook event(s): %s: %s", len(batch), type(e).__name__, e)
+
     async def shutdown(self):
         """
         Close database connections.
         Call this on application shutdown.
         """
+        if self._event_writer_task:
+            # Flush whatever is still queued before the pool goes away
+            await self._event_queue.put(None)
+            await self._event_writer_task
+            self._event_writer_task = None
+
         if self.engine:
             await self.engine.dispose()
-            print("🔌 Database connections closed")
+            logger.info("🔌 Database connections closed")
 
     async def get_session(self) -> AsyncGenerator[AsyncSession, None]:
         """
@@ -145,16 +280,16 @@ class DatabaseService:
         if not self._initialized:
             return 0
 
-        cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
 
         async with self.session_factory() as session:
             result = await session.execute(
-                text("DELETE FROM message_events WHERE created_at < :cutoff"),
+                _DELETE_OLD,
                 {"cutoff": cutoff_date}
             )
             await session.commit()
             deleted_count = result.rowcount
-            print(f"🧹 Cleaned up {deleted_count} events older than {retention_days} days")
+            logger.info("🧹 Cleaned up %d events older than %d days", deleted_count, retention_days)
             return deleted_count
 
     async def health_check(self) -> dict:
@@ -167,7 +302,7 @@ class DatabaseService:
 
         try:
             async with self.session_factory() as session:
-                await session.execute(text("SELECT 1"))
+                await session.execute(_HEALTH_PING)
             return {"status": "healthy", "message": "Database connection OK"}
         except Exception as e:
             return {"status": "unhealthy", "message": str(e)}
@@ -3,17 +3,25 @@ Delivery Service - Handles package tracking notifications
 """
 import asyncio
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Union
 
 from ..models.schemas import DeliveryRequest
 from .one_signal_message_service import onesignal_message_service
 
+# The three notifications of a delivery sequence, sent `interval` seconds apart
+DELIVERY_STAGES = (
+    ("📬", "Delivery Pickup"),
+    ("🚚", "In transit"),
+    ("✅", "Delivered"),
+)
+
 
 class DeliveryService:
     """Service for managing 3 step delivery process"""
 
     def __init__(self):
-        self.active_jobs: Dict[str, bool] = {}
+        # tracking_id -> the stage being sent (Task) or the timer for the next one
+        self.active_jobs: Dict[str, Union[asyncio.Task, asyncio.TimerHandle]] = {}
 
     async def schedule_delivery_sequence(self, request: DeliveryRequest) -> Dict:
         """Schedule 3 notifications delivery with configurable intervals
@@ -25,15 +33,12 @@ class DeliveryService:
             Status of scheduling
         """
 
-        if request.tracking_id in self.active_jobs and self.active_jobs[request.tracking_id]:
+        if request.tracking_id in self.active_jobs:
             return {
                 "status": "error",
                 "message": f"Already tracking {request.tracking_id}"
             }
 
-        # Mark as active
-        self.active_jobs[request.tracking_id] = True
-
         # Determine notification interval
         interval = request.notification_interval if request.notification_interval else 60
 
@@ -41,8 +46,9 @@ class DeliveryService:
         if request.demo_mode:
             print(f"⚡ Demo mode enabled for {request.tracking_id} - {interval}s intervals")
 
-        # Start the notification sequence
-        asyncio.create_task(self._send_delivery_sequence(request, interval))
+        # Start the notification sequence with the first stage right away
+        print(f"📦 Starting delivery sequence for {request.tracking_id} (interval: {interval}s)")
+        self._start_stage(request, 0, interval)
 
         response = {
             "status": "success",
@@ -56,33 +62,52 @@ class DeliveryService:
 
         return response
 
-    async def _send_delivery_sequence(self, request: DeliveryRequest, interval: int = 60):
-        """Send 3 notifications with configurable intervals
+    def _start_stage(self, request: DeliveryRequest, stage: int, interval: int):
+        """Spawn the task sending one stage; keep it so it can be cancelled on shutdown"""
+        task = asyncio.create_task(self._send_delivery_stage(request, stage, interval))
+        self.active_jobs[request.tracking_id] = task
+
+    async def _send_delivery_stage(self, request: DeliveryRequest, stage: int, interval: int = 60):
+        """Send one notification of the sequence and schedule the next one
+
+        Nothing waits between stages: the next stage is a loop timer, so no
+        coroutine is kept alive for the whole sequence.
 
         Args:
             request: Delivery request with tracking info
+            stage: Index into DELIVERY_STAGES
             interval: Seconds between notifications (default 60)
         """
+        emoji, status = DELIVERY_STAGES[stage]
         try:
-            print(f"📦 Starting delivery sequence for {request.tracking_id} (interval: {interval}s)")
-
-            await onesignal_message_service.send_delivery_notification(request, "Delivery Pickup")
-            print(f"📬 Sent 'Delivery Pickup' for {request.tracking_id}, waiting {interval}s...")
-
-            await asyncio.sleep(interval)
-
-            await onesignal_message_service.send_delivery_notification(request, "In transit")
-            print(f"🚚 Sent 'In transit' for {request.tracking_id}, waiting {interval}s...")
-
-            await asyncio.sleep(interval)
-
-            await onesignal_message_service.send_delivery_notification(request, "Delivered")
-            print(f"✅ Sent 'Delivered' for {request.tracking_id}")
-
+            if stage == 0:
+                await onesignal_message_service.send_delivery_notification(request, status)
+            else:
+                # Later stages are status updates: queue them, don't wait on OneSignal
+                onesignal_message_service.send_delivery_notification_async_confirm(request, status)
         except Exception as e:
             print(f"❌ Error in delivery sequence for {request.tracking_id}: {e}")
-        finally:
-            self.active_jobs[request.tracking_id] = False
-            print(f"🏁 Completed delivery sequence for {request.tracking_id}")
+        else:
+            if stage + 1 < len(DELIVERY_STAGES):
+                print(f"{emoji} Sent '{status}' for {request.tracking_id}, waiting {interval}s...")
+                self.active_jobs[request.tracking_id] = asyncio.get_running_loop().call_later(
+                    interval, self._start_stage, request, stage + 1, interval
+                )
+                return
+            print(f"{emoji} Sent '{status}' for {request.tracking_id}")
+
+        self.active_jobs.pop(request.tracking_id, None)
+        print(f"🏁 Completed delivery sequence for {request.tracking_id}")
+
+    async def shutdown(self):
+        """Cancel pending and running delivery stages and wait for them to finish"""
+        jobs = list(self.active_jobs.values())
+        self.active_jobs.clear()
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(
+            *(job for job in jobs if isinstance(job, asyncio.Task)),
+            return_exceptions=True
+        )
 
 delivery_service = DeliveryService()
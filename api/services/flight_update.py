@@ -1,11 +1,20 @@
 """ Service to generate a flight update live activity"""
 import asyncio
-from datetime import datetime, timezone
+import time
+from typing import Union
 from api.storage.kv_store import KVStore
 from api.models.schemas import FlightUpdateContentState, FlightUpdateLiveActivity
 from api.config import settings
 from api.services.one_signal_message_service import onesignal_message_service
 
+# Demo steps, each sent step_delay seconds after the previous one:
+# (Live Activity event, status, boarding group)
+FLIGHT_STEPS = (
+    ("update", "boarding", 1),
+    ("update", "finalCall", 2),
+    ("end", "closed", 2),  # Final state before dismissal
+)
+
 
 class FlightLiveActivityService:
     def __init__(self, kv: KVStore, *, step_delay_seconds: int = 10):
@@ -15,10 +24,12 @@ class FlightLiveActivityService:
         """
         self.kv = kv
         self.step_delay = step_delay_seconds
-        self.active_jobs: dict[str, bool] = {}
-    def register(self, req: FlightUpdateLiveActivity) -> dict:
+        # activity_id -> the step being sent (Task) or the timer for the next one
+        self.active_jobs: dict[str, Union[asyncio.Task, asyncio.TimerHandle]] = {}
+
+    async def register(self, req: FlightUpdateLiveActivity) -> dict:
         key = f"live:flightUpdate:{req.activity_id}"
-        now = datetime.utcnow().isoformat()
+        now = time.time()  # epoch seconds
 
         record = {
             "activity_id": req.activity_id,
@@ -33,7 +44,7 @@ class FlightLiveActivityService:
         }
 
     # Demo: overwrite if it exists; no idempotency needed
-        self.kv.set(key, record)
+        await self.kv.set(key, record)
         return {"ok": True, "activity_id": req.activity_id, "stored": record}
 
     async def schedule_emoji_sequence(self, payload: FlightUpdateLiveActivity) -> dict:
@@ -41,78 +52,84 @@ class FlightLiveActivityService:
         aid = payload.activity_id
 
         # prevent duplicate runs for the same activity_id
-        if self.active_jobs.get(aid):
+        if aid in self.active_jobs:
             return {"status": "error", "message": f"Sequence already running for {aid}"}
 
-        # 1) persist baseline state
-        self.register(payload)
-
-        # 2) mark active and spawn the runner 
-        self.active_jobs[aid] = True
-        asyncio.create_task(self._run_emoji_sequence(
-            aid,
+        # 1) schedule the first step (registered before the first await so a
+        #    concurrent request for the same id is rejected)
+        self._schedule_step(
+            aid, 0,
             gate=payload.content_state.gate,
             boarding_time=payload.content_state.boardingTime
-            ))
+        )
+
+        # 2) persist baseline state (the first step only fires after step_delay)
+        await self.register(payload)
 
         return {"status": "started", "activity_id": aid}
 
-    async def _run_emoji_sequence(self, activity_id: str, gate: str, boarding_time: str = None) -> None:
-        """10s → update → 10s → update → 10s → end (emoji-only MVP)."""
+    def _schedule_step(self, activity_id: str, step: int, gate: str, boarding_time: str = None) -> None:
+        """Arm a loop timer for the next step; no coroutine waits in between."""
+        self.active_jobs[activity_id] = asyncio.get_running_loop().call_later(
+            self.step_delay, self._start_step, activity_id, step, gate, boarding_time
+        )
+
+    def _start_step(self, activity_id: str, step: int, gate: str, boarding_time: str = None) -> None:
+        """Timer callback: spawn the task sending one step, kept for cancellation."""
+        self.active_jobs[activity_id] = asyncio.create_task(
+            self._run_emoji_step(activity_id, step, gate, boarding_time)
+        )
+
+    async def _run_emoji_step(self, activity_id: str, step: int, gate: str, boarding_time: str = None) -> None:
+        """Send one step of 10s → update → 10s → update → 10s → end (emoji-only MVP)."""
+        event, status, group = FLIGHT_STEPS[step]
         try:
-            # step 1: baggage claim
-            await asyncio.sleep(self.step_delay)
-            event = "update"
-            event_updates = {"gate": gate, "boardingTime": boarding_time,"status": "boarding","group":1}
-            await onesignal_message_service.update_live_activity(
-                activity_id=activity_id,
-                event=event,
-                event_updates=event_updates
-            )
-            self._kv_update_state(activity_id, status="boarding")
-
-            # step 2: landed
-            await asyncio.sleep(self.step_delay)
-            event = "update"
-            event_updates = {"gate": gate, "boardingTime": boarding_time,"status": "finalCall","group":2}
+            event_updates = {"gate": gate, "boardingTime": boarding_time, "status": status, "group": group}
             await onesignal_message_service.update_live_activity(
                 activity_id=activity_id,
                 event=event,
                 event_updates=event_updates
             )
-            self._kv_update_state(activity_id, status="finalCall", group=2)
 
-            # step 3: end the Live Activity
-            await asyncio.sleep(self.step_delay)
-            event = "end"
-            event_updates = {"gate": gate, "boardingTime": boarding_time,"status": "closed","group":2}  # Final state before dismissal
-            await onesignal_message_service.update_live_activity(
-                activity_id=activity_id,
-                event=event,
-                event_updates=event_updates
-            )
-            self._kv_mark_ended(activity_id)
+            if event == "end":
+                await self._kv_mark_ended(activity_id)
+            else:
+                await self._kv_update_state(activity_id, status=status, group=group)
+                self._schedule_step(activity_id, step + 1, gate, boarding_time)
+                return
 
         except Exception as e:
             print(f"[flight_update] sequence error for {activity_id}: {e}")
-        finally:
-            self.active_jobs[activity_id] = False
-    def _kv_update_state(self, activity_id: str, *, status: str = None, group: str = None) -> None:
+
+        self.active_jobs.pop(activity_id, None)
+
+    async def shutdown(self) -> None:
+        """Cancel pending and running steps and wait for them to finish"""
+        jobs = list(self.active_jobs.values())
+        self.active_jobs.clear()
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(
+            *(job for job in jobs if isinstance(job, asyncio.Task)),
+            return_exceptions=True
+        )
+
+    async def _kv_update_state(self, activity_id: str, *, status: str = None, group: str = None) -> None:
         key = f"live:flightUpdate:{activity_id}"
-        rec = self.kv.get(key) or {}
+        rec = await self.kv.get(key) or {}
         if status:
             rec.setdefault("state", {})["status"] = status
         if group:
             rec.setdefault("state", {})["group"] = group
-        rec["updated_at"] = datetime.utcnow().isoformat()
-        self.kv.set(key, rec)
+        rec["updated_at"] = time.time()
+        await self.kv.set(key, rec)
 
-    def _kv_mark_ended(self, activity_id: str) -> None:
+    async def _kv_mark_ended(self, activity_id: str) -> None:
         key = f"live:flightUpdate:{activity_id}"
-        rec = self.kv.get(key) or {}
+        rec = await self.kv.get(key) or {}
         rec["status"] = "ended"
-        rec["updated_at"] = datetime.utcnow().isoformat()
-        self.kv.set(key, rec)
+        rec["updated_at"] = time.time()
+        await self.kv.set(key, rec)
 # Create singleton instance
 from api.storage.kv_store import kv_store
 flight_service = FlightLiveActivityService(kv=kv_store, step_delay_seconds=10)
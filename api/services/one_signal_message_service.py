@@ -1,14 +1,202 @@
 ### OneSignal Service. This file handles OneSignal 'Message' APIs
 
 import aiohttp
-import json
-import sys
-from typing import Dict, Optional
+import asyncio
+import logging
+import orjson
+from enum import IntEnum
+from typing import Dict, List, Optional
 from ..config import settings
 from ..models.schemas import DeliveryRequest    
 from ..storage.kv_store import kv_store
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+
+def _json_dumps(obj) -> str:
+    """Request body encoder for the shared session (aiohttp expects a str)"""
+    return orjson.dumps(obj).decode()
+
+
+async def _read_json(response: aiohttp.ClientResponse):
+    """Response body decoded with orjson straight from the raw bytes"""
+    return orjson.loads(await response.read())
+
+
+class Environment(IntEnum):
+    """The OneSignal apps this server sends through"""
+    SIGNAL_POST = 1
+    EMEA_DEMO = 2
+    SIGNAL_AIR = 3
+
+
+# Most fire-and-forget delivery notifications waiting on OneSignal at once
+MAX_INFLIGHT_NOTIFICATIONS = 64
+
+# Template IDs as the API expects them, stringified once at import
+SMS_OTP_TEMPLATE_ID = str(settings.emea_se_demo_sms_otp)
+DELIVERY_TEMPLATE_IDS = {
+    "Delivery Pickup": str(settings.signal_post_delivery_pickup),
+    "In transit": str(settings.signal_post_in_transit),
+    "Delivered": str(settings.signal_post_delivered)
+}
+
+class DeliveryNotificationBatcher:
+    """
+    Coalesces concurrent send_delivery_notification calls into batch sends.
+
+    Calls arriving within max_wait_ms of the first one (up to max_batch_size)
+    are grouped by (status, environment) and sent with
+    send_delivery_notifications_batch; each caller gets its own response.
+    """
+
+    def __init__(self, service: "OneSignalMessageService", max_batch_size: int = 50, max_wait_ms: int = 25):
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set = set()  # in-flight batch sends, awaited on stop()
+
+    def start(self):
+        """Start the background collector if it isn't running"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Send what is queued, then wait for every in-flight batch"""
+        if self._task and not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        await asyncio.gather(*self._sends, return_exceptions=True)
+
+    async def submit(self, request: DeliveryRequest, status: str, environment: int) -> Dict:
+        """Queue one notification and wait for its OneSignal response"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((request, status, environment, future))
+        return await future
+
+    async def run(self):
+        """Collect queued calls into batches until stop() sends the None sentinel"""
+        loop = asyncio.get_running_loop()
+        running = True
+        while running:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            # Send in the background so collection of the next batch isn't held up
+            send = asyncio.create_task(self._send(batch))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+
+    async def _send(self, batch: list):
+        """Send one collected batch and resolve the callers' futures"""
+        groups: Dict[tuple, list] = {}
+        for request, status, environment, future in batch:
+            groups.setdefault((status, environment), []).append((request, future))
+
+        async def send_group(status: str, environment: int, items: list):
+            try:
+                responses = await self.service.send_delivery_notifications_batch(
+                    [request for request, _ in items], status, environment
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), response in zip(items, responses):
+                    if not future.done():
+                        future.set_result(response)
+
+        await asyncio.gather(*(
+            send_group(status, environment, items)
+            for (status, environment), items in groups.items()
+        ))
+
+
+class LiveActivityCoalescer:
+    """
+    Merges Live Activity updates for the same activity into one request.
+
+    The first "update" for an activity opens a flush_ms window; updates
+    arriving within it are merged into its event_updates (later values win)
+    and sent as one request when the window closes. Every caller gets the
+    response of the request that carried its update. Other events ("end")
+    are sent at once, carrying any update still pending for the activity.
+    """
+
+    def __init__(self, service: "OneSignalMessageService", flush_ms: int = 500):
+        self.service = service
+        self.flush_interval = flush_ms / 1000
+        # (activity_id, environment) -> merged event_updates and the callers' futures
+        self._pending: Dict[tuple, dict] = {}
+        self._flushes: set = set()  # scheduled flushes, awaited on stop()
+
+    async def submit(self, activity_id: str, event: str, event_updates: dict, environment: int) -> Dict:
+        """Send (or merge) one Live Activity event and wait for its OneSignal response"""
+        key = (activity_id, environment)
+
+        if event != "update":
+            pending = self._pending.pop(key, None)
+            if pending:
+                event_updates = {**pending["updates"], **event_updates}
+            response = await self.service._post_live_activity(activity_id, event, event_updates, environment)
+            if pending:
+                self._resolve(pending["waiters"], response)
+            return response
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {"updates": {}, "waiters": []}
+            flush = asyncio.create_task(self._flush(key))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        pending["updates"].update(event_updates)
+        future = asyncio.get_running_loop().create_future()
+        pending["waiters"].append(future)
+        return await future
+
+    async def stop(self):
+        """Wait for the scheduled flushes so no merged update is lost"""
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush(self, key: tuple):
+        """Send the merged update once the window closes (unless an "end" took it)"""
+        await asyncio.sleep(self.flush_interval)
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        activity_id, environment = key
+        response = await self.service._post_live_activity(activity_id, "update", pending["updates"], environment)
+        self._resolve(pending["waiters"], response)
+
+    @staticmethod
+    def _resolve(waiters: list, response: Dict):
+        for future in waiters:
+            if not future.done():
+                future.set_result(response)
+
+
 class OneSignalMessageService:
     """Service for sending messages via OneSignal"""
     
@@ -25,11 +213,83 @@ class OneSignalMessageService:
         self.api_key_3 = settings.signal_air_api_key
         ## Reserved for more environments
 
+        # Per-environment app IDs and request headers, built once
+        # (Basic auth for notifications, Key auth for Live Activities)
+        environments = (
+            (Environment.SIGNAL_POST, self.app_id_1, self.api_key_1),
+            (Environment.EMEA_DEMO, self.app_id_2, self.api_key_2),
+            (Environment.SIGNAL_AIR, self.app_id_3, self.api_key_3),
+        )
+        self._app_ids = {env: app_id for env, app_id, _ in environments}
+        self._basic_headers = {
+            env: {"Content-Type": "application/json", "Authorization": f"Basic {api_key}"}
+            for env, _, api_key in environments
+        }
+        self._key_headers = {
+            env: {"Content-Type": "application/json", "Authorization": f"Key {api_key}"}
+            for env, _, api_key in environments
+        }
+
         self.base_url = "https://api.onesignal.com/notifications"
         self.live_activity_base_url = "https://api.onesignal.com/apps/{app_id}/live_activities/{activity_id}/notifications"
+        # Live Activity URLs up to the activity id, per environment (app_id is fixed)
+        self._la_url_prefix = {
+            env: f"https://api.onesignal.com/apps/{app_id}/live_activities/"
+            for env, app_id in self._app_ids.items()
+        }
+
+        # One HTTP session for every OneSignal call so TCP/TLS connections are
+        # kept alive and reused; opened in startup(), closed in shutdown()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Coalesces concurrent delivery notifications into batch sends
+        self._batcher = DeliveryNotificationBatcher(self)
+
+        # Merges Live Activity updates sent in quick succession
+        self._live_activities = LiveActivityCoalescer(self)
+
+        # Fire-and-forget delivery notifications, awaited on shutdown
+        self._dispatch_sem = asyncio.Semaphore(MAX_INFLIGHT_NOTIFICATIONS)
+        self._inflight: set = set()
+
+    async def startup(self):
+        """Open the shared HTTP session and start the delivery batcher (call from the app lifespan)"""
+        self.get_session()
+        self._batcher.start()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        The shared session for every OneSignal request, opened on first use.
+        Other services talking to api.onesignal.com use it too, so they share one pool.
+        """
+        if self._session is None or self._session.closed:
+            # Every request goes to the same host: no global cap, a per-host cap
+            # instead, DNS cached for 10 minutes and idle connections kept for 90s.
+            # No OneSignal call may hold a caller for more than 5 seconds.
+            self._session = aiohttp.ClientSession(
+                json_serialize=_json_dumps,  # orjson for every json= request body
+                timeout=aiohttp.ClientTimeout(total=5),
+                connector=aiohttp.TCPConnector(
+                    limit=0,
+                    limit_per_host=64,
+                    ttl_dns_cache=600,
+                    keepalive_timeout=90,
+                    enable_cleanup_closed=True
+                )
+            )
+        return self._session
+
+    async def shutdown(self):
+        """Flush pending delivery notifications and Live Activity updates, then close the shared HTTP session"""
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._batcher.stop()
+        await self._live_activities.stop()
+        if self._session:
+            await self._session.close()
+            self._session = None
 
     ### SMS OTP from EMEA SE Demo App
-    async def send_sms_otp(self, phone_number: str, otp_code: str, environment: int = 2) -> Dict:
+    async def send_sms_otp(self, phone_number: str, otp_code: str, environment: int = Environment.EMEA_DEMO) -> Dict:
         """
         Send an OTP SMS using OneSignal
 
@@ -40,97 +300,143 @@ class OneSignalMessageService:
         Returns:
             Response from OneSignal API
         """
+        environment = Environment(environment)  # ValueError for an unknown app
         ### Create Message Payload
         payload = {
-            "app_id": getattr(self, f"app_id_{environment}"),
-            "template_id": settings.emea_se_demo_sms_otp,
+            "app_id": self._app_ids[environment],
+            "template_id": SMS_OTP_TEMPLATE_ID,
             "include_phone_numbers": [phone_number],
             "custom_data": {
                 "signal_code": otp_code
             }
         }
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {getattr(self, f'api_key_{environment}')}"
-        }
+        headers = self._basic_headers[environment]
         ### API Request
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.base_url,
-                json=payload,
-                headers=headers
-            ) as response:
-                response_data = await response.json()
-                print(f"Response from OneSignal: {response_data}", file=sys.stderr, flush=True)
-                return response_data
+        async with self.get_session().post(
+            self.base_url,
+            json=payload,
+            headers=headers
+        ) as response:
+            response_data = await _read_json(response)
+            logger.info("Response from OneSignal: %s", response_data)
+            return response_data
                 
     ### Delivery Service Sequence
-    async def send_delivery_notification(self, request: DeliveryRequest, status: str, environment=1) -> Dict:
+    async def send_delivery_notification(self, request: DeliveryRequest, status: str, environment=Environment.SIGNAL_POST) -> Dict:
         """Send Delivery Notification Sequence"""
+        environment = Environment(environment)  # ValueError for an unknown app
 
         # Debug: Log what we're about to send
-        print(f"🔍 DEBUG - Attempting to send: {status}", file=sys.stderr, flush=True)
-        print(f"🔍 DEBUG - Environment: {environment}", file=sys.stderr, flush=True)
-        print(f"🔍 DEBUG - External ID: {request.external_id}", file=sys.stderr, flush=True)
-        print(f"🔍 DEBUG - App ID: {getattr(self, f'app_id_{environment}', 'NOT FOUND')}", file=sys.stderr, flush=True)
-    
-        template_mapping = {
-            "Delivery Pickup": settings.signal_post_delivery_pickup,
-            "In transit": settings.signal_post_in_transit,
-            "Delivered": settings.signal_post_delivered
-        }
-        
-        template_id = template_mapping.get(status)
-        print(f"🔍 DEBUG - Template ID: {template_id}", file=sys.stderr, flush=True)
+        logger.debug(
+            "🔍 Attempting to send: %s (environment %s, external_id %s, app_id %s)",
+            status, environment, request.external_id, self._app_ids[environment]
+        )
+
+        template_id = DELIVERY_TEMPLATE_IDS.get(status)
+        logger.debug("🔍 Template ID: %s", template_id)
 
         if not template_id:
             raise ValueError(f"Invalid status: {status}")
         
-        payload = {
-            "app_id": getattr(self, f"app_id_{environment}"),
+        # Concurrent calls are coalesced and sent with send_delivery_notifications_batch
+        return await self._batcher.submit(request, status, environment)
+
+    def send_delivery_notification_async_confirm(self, request: DeliveryRequest, status: str, environment=Environment.SIGNAL_POST) -> Dict:
+        """
+        Queue a delivery notification and return without waiting for OneSignal
+
+        For status updates where the caller only needs to know the send was
+        accepted. Failures are logged by the background task.
+
+        Returns:
+            {"status": "queued"}
+        """
+        if status not in DELIVERY_TEMPLATE_IDS:
+            raise ValueError(f"Invalid status: {status}")
+        environment = Environment(environment)
+
+        task = asyncio.create_task(self._send_with_sem(request, status, environment))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return {"status": "queued"}
+
+    async def _send_with_sem(self, request: DeliveryRequest, status: str, environment: int) -> None:
+        """Send one queued notification, at most MAX_INFLIGHT_NOTIFICATIONS at a time"""
+        async with self._dispatch_sem:
+            try:
+                await self.send_delivery_notification(request, status, environment)
+            except Exception as e:
+                logger.error("❌ Queued '%s' for %s failed: %s: %s", status, request.tracking_id, type(e).__name__, e)
+
+    async def send_delivery_notifications_batch(self, requests: List[DeliveryRequest], status: str, environment=Environment.SIGNAL_POST) -> List[Dict]:
+        """
+        Send the same delivery status to many parcels with as few OneSignal requests as possible
+
+        custom_data is per notification, so requests are grouped by
+        (tracking_id, parcel_destination) and each group goes out as one
+        notification addressed to all of its external_ids. Groups are sent concurrently.
+
+        Returns:
+            The OneSignal response for each request, in request order
+        """
+        template_id = DELIVERY_TEMPLATE_IDS.get(status)
+        if not template_id:
+            raise ValueError(f"Invalid status: {status}")
+
+        groups: Dict[tuple, List[int]] = {}
+        for index, request in enumerate(requests):
+            groups.setdefault((request.tracking_id, request.parcel_destination), []).append(index)
+
+        headers = self._basic_headers[environment]
+
+        async def send_group(tracking_id: str, parcel_destination: str, indexes: List[int]) -> Dict:
+            # dict.fromkeys drops repeated recipients while keeping their order
+            external_ids = list(dict.fromkeys(requests[i].external_id for i in indexes))
+            payload = self._delivery_payload(external_ids, template_id, tracking_id, parcel_destination, environment)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔍 Full payload: %s", orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode())
+            try:
+                async with self.get_session().post(
+                    self.base_url,
+                    json=payload,
+                    headers=headers
+                ) as response:
+                    response_data = await _read_json(response)
+                    logger.info("✅ OneSignal Response (%s): %s", response.status, response_data)
+                    return response_data
+            except Exception as e:
+                logger.error("❌ OneSignal Request Failed: %s: %s", type(e).__name__, e)
+                return {"error": str(e), "error_type": type(e).__name__}
+
+        logger.debug("📡 Sending '%s' to %d parcels in %d OneSignal requests", status, len(requests), len(groups))
+        results = await asyncio.gather(*(
+            send_group(tracking_id, parcel_destination, indexes)
+            for (tracking_id, parcel_destination), indexes in groups.items()
+        ))
+
+        responses: List[Dict] = [None] * len(requests)
+        for indexes, result in zip(groups.values(), results):
+            for index in indexes:
+                responses[index] = result
+        return responses
+
+    def _delivery_payload(self, external_ids: List[str], template_id: str, tracking_id: str, parcel_destination: str, environment: int) -> Dict:
+        """Build the push notification body for a delivery status update"""
+        return {
+            "app_id": self._app_ids[environment],
             "include_aliases": {
-                "external_id": [request.external_id]
+                "external_id": external_ids
             },
             "target_channel": "push",
             "template_id": template_id,
             "custom_data": {
-                "tracking_id": request.tracking_id,
-                "parcel_destination": request.parcel_destination
+                "tracking_id": tracking_id,
+                "parcel_destination": parcel_destination
             }
         }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {getattr(self, f'api_key_{environment}')}"
-        }
-        
-        print(f"🔍 DEBUG - Full payload: {json.dumps(payload, indent=2)}", file=sys.stderr, flush=True)
-        
-        ### API Request with error handling
-        try:
-            async with aiohttp.ClientSession() as session:
-                print("📡 Making OneSignal request...", file=sys.stderr, flush=True)
-                
-                async with session.post(
-                    self.base_url,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    # Add these new debug lines
-                    print(f"📡 Response received!", file=sys.stderr, flush=True)
-                    print(f"📡 Status Code: {response.status}", file=sys.stderr, flush=True)
-                    
-                    response_data = await response.json()
-                    print(f"✅ OneSignal Response: {response_data}", file=sys.stderr, flush=True)
-                    
-                    return response_data
-                    
-        except Exception as e:
-            print(f"❌ OneSignal Request Failed: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
-            return {"error": str(e), "error_type": type(e).__name__}
 
     ### Live Activity flight Update ###
-    async def update_live_activity(self, activity_id: str, event: str, event_updates: dict, environment: int = 3) -> Dict:
+    async def update_live_activity(self, activity_id: str, event: str, event_updates: dict, environment: int = Environment.SIGNAL_AIR) -> Dict:
         """
         Update a Live Activity's content_state
         
@@ -140,38 +446,34 @@ class OneSignalMessageService:
             event_updates: Dict containing the content_state fields (e.g., {"emoji": "🛄"})
             environment: Which OneSignal app to use (default: 3 = Signal Air)
         Returns:
-            Response from OneSignal API
+            Response from OneSignal API (shared by updates merged into one request)
         """
-        app_id = getattr(self, f"app_id_{environment}")
-        api_key = getattr(self, f"api_key_{environment}")
+        environment = Environment(environment)  # ValueError for an unknown app
+        # Updates within the same short window are merged into one request
+        return await self._live_activities.submit(activity_id, event, event_updates, environment)
+
+    async def _post_live_activity(self, activity_id: str, event: str, event_updates: dict, environment: int) -> Dict:
+        """POST one Live Activity event to OneSignal"""
         # Build Live Activity URL
-        live_activity_url = self.live_activity_base_url.format(
-            app_id=app_id,
-            activity_id=activity_id
-        )
+        live_activity_url = f"{self._la_url_prefix[environment]}{activity_id}/notifications"
         payload = {
             "event": event,
             "event_updates": event_updates,
             "name": "Flight Update"
         }
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Key {api_key}"
-        }        
+        headers = self._key_headers[environment]        
         # Make Update Live Actitivy Request
         try: 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    live_activity_url,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    print(f"Response Status {response.status}", file=sys.stderr, flush=True)
-                    response_data = await response.json()
-                    print(f"OneSignal Response: {response_data}", file=sys.stderr, flush=True)
-                    return response_data
+            async with self.get_session().post(
+                live_activity_url,
+                json=payload,
+                headers=headers
+            ) as response:
+                response_data = await _read_json(response)
+                logger.info("OneSignal Response (%s): %s", response.status, response_data)
+                return response_data
         except Exception as e:
-            print(f"Error: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
+            logger.error("Error: %s: %s", type(e).__name__, e)
             return {"error": str(e), "error_type": type(e).__name__}
 
 
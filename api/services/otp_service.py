@@ -3,14 +3,23 @@
 OTP Service - Handles all OTP-related business logic
 This is separate from the HTTP layer (routers)
 """
-import random
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
 from typing import Dict, Optional, Tuple
-from .one_signal_message_service import onesignal_message_service
+from .one_signal_message_service import onesignal_message_service, Environment
 from ..models.schemas import StoredOTP
 from ..config import settings
-from ..storage.kv_store import kv_store
+from ..storage.kv_store import kv_store, JSON_CODEC, MSGPACK_CODEC
 
+logger = logging.getLogger(__name__)
+
+# Codes verified in this process are remembered for as long as the KV keeps
+# the used record, so client retries are answered without a KV round-trip
+RECENT_VERIFY_TTL = 60
+RECENT_VERIFY_MAX = 10000
 
 
 class OTPService:
@@ -20,6 +29,9 @@ class OTPService:
         self.kv = kv_store
         self.otp_prefix = "otp:"
         self.rate_limit_prefix = "rate:"
+        self.used_prefix = "otp_used:"  # Set once a code is verified
+        # OTP key -> monotonic expiry, oldest first
+        self._recently_used: OrderedDict[str, float] = OrderedDict()
         
     async def generate_otp(self, phone_number: str) -> str:
         """
@@ -31,47 +43,42 @@ class OTPService:
         Returns:
             The generated OTP code
         """
-        # Check rate limit
+        # Count this request against the rate limit (1 hour window, started
+        # by the first request) in a single round-trip
         rate_key = f"{self.rate_limit_prefix}{phone_number}"
-        attempts = self.kv.get(rate_key) or 0
+        attempts = await self.kv.increment(rate_key, ttl=3600)
         
-        if attempts >= 60:
+        if attempts > 60:
             raise Exception("Too many OTP requests. Please try again later.")
         
-        # Generate random 5-digit code
-        code = str(random.randint(10000, 99999))
+        # Generate random 5-digit code (CSPRNG: the code is a login credential)
+        code = f"{secrets.randbelow(90000) + 10000}"
         
         # Create storage key
         key = f"{self.otp_prefix}{phone_number}:{code}"
         
         # Store the OTP with 5-minute TTL
-        otp_data = {
-            "phone_number": phone_number,
-            "code": code,
-            "created_at": datetime.now().isoformat(),
-            "used": False
-        }
-        
-        self.kv.set(key, otp_data, ttl=300)  # 5 minutes
+        otp = StoredOTP(
+            phone_number=phone_number,
+            code=code,
+            created_at=time.time()
+        )
         
-        # Update rate limit (1 hour TTL)
-        self.kv.increment(rate_key)
-        if attempts == 0:  # First attempt, set TTL
-            self.kv.set(rate_key, 1, ttl=3600)
+        await self.kv.set(key, otp.to_record(), ttl=300, codec=MSGPACK_CODEC)  # 5 minutes
         
-        print(f"Generated OTP {code} for {phone_number}")
+        logger.debug("Generated OTP %s for %s", code, phone_number)
         
         # OTP Message via OneSignal
         if settings.has_onesignal:
             try:
-                await onesignal_message_service.send_sms_otp(phone_number, code, environment=2)
-                print(f"Send OTP {code} to {phone_number} successfully")
+                await onesignal_message_service.send_sms_otp(phone_number, code, environment=Environment.EMEA_DEMO)
+                logger.debug("Sent OTP %s to %s", code, phone_number)
             except Exception as e:
-                print(f"Failed to send OTP")
+                logger.error("Failed to send OTP: %s: %s", type(e).__name__, e)
 
             # await send_onesignal_notification(phone_number, code)
         else:
-            print("OneSignal not configured - OTP not sent")
+            logger.warning("OneSignal not configured - OTP not sent")
             
         return code
     
@@ -88,34 +95,43 @@ class OTPService:
         """
         key = f"{self.otp_prefix}{phone_number}:{code}"
         
-        # Get OTP from KV
-        otp_data = self.kv.get(key)
+        # Retry of a code this process just verified: only ever a "used" answer,
+        # a cached success would let the same code be replayed
+        if self._was_recently_used(key):
+            return False, "Code already used"
+        
+        # Mark as used, only if it exists and isn't used yet (one atomic
+        # round-trip; the code and its marker are kept 1 minute after use)
+        claimed = await self.kv.claim_once(key, f"{self.used_prefix}{phone_number}:{code}", ttl=60)
         
         # Check if OTP exists
-        if not otp_data:
+        if claimed < 0:
             return False, "Invalid code or expired"
         
         # Check if already used
-        if otp_data.get("used"):
+        if claimed == 0:
             return False, "Code already used"
         
-        # Mark as used
-        otp_data["used"] = True
-        self.kv.set(key, otp_data, ttl=60)  # Keep for 1 minute after use
+        self._remember_used(key)
         
         return True, "Code verified successfully"
     
-    async def cleanup_expired_otps(self) -> int:
-        """
-        Cleanup is automatic with TTL, but this can force cleanup
-        
-        Returns:
-            Number of OTPs cleaned up
-        """
-        # With TTL, Redis automatically removes expired keys
-        # This method is kept for compatibility
-        keys = self.kv.get_keys(f"{self.otp_prefix}*")
-        return len(keys)  # Just return count of active OTPs
+    def _was_recently_used(self, key: str) -> bool:
+        """Check the in-process record of verified codes, dropping it once expired"""
+        expires_at = self._recently_used.get(key)
+        if expires_at is None:
+            return False
+        if expires_at > time.monotonic():
+            return True
+        del self._recently_used[key]
+        return False
+    
+    def _remember_used(self, key: str) -> None:
+        """Record a verified code, evicting the oldest entries past RECENT_VERIFY_MAX"""
+        self._recently_used[key] = time.monotonic() + RECENT_VERIFY_TTL
+        self._recently_used.move_to_end(key)
+        while len(self._recently_used) > RECENT_VERIFY_MAX:
+            self._recently_used.popitem(last=False)
     
     async def get_storage_debug(self) -> dict:
         """Get current storage state for debugging"""
@@ -124,20 +140,25 @@ class OTPService:
             "rate_limits": []
         }
         
-        # Get all OTP keys
-        otp_keys = self.kv.get_keys(f"{self.otp_prefix}*")
-        for key in otp_keys:
-            otp_data = self.kv.get(key)
+        # Get all OTP keys (SCAN, then one MGET for the values)
+        otp_keys = await self.kv.scan_keys(f"{self.otp_prefix}*")
+        used_keys = [key.replace(self.otp_prefix, self.used_prefix, 1) for key in otp_keys]
+        otp_records, used_markers = await asyncio.gather(
+            self.kv.get_many(otp_keys, codec=MSGPACK_CODEC),
+            self.kv.get_many(used_keys, codec=JSON_CODEC)
+        )
+        for key, otp_data, used in zip(otp_keys, otp_records, used_markers):
             if otp_data:
+                otp = StoredOTP.from_record(otp_data)
+                otp.used = otp.used or bool(used)
                 debug_info["active_otps"].append({
                     "key": key,
-                    "data": otp_data
+                    "data": otp.to_dict()
                 })
         
         # Get rate limit info
-        rate_keys = self.kv.get_keys(f"{self.rate_limit_prefix}*")
-        for key in rate_keys:
-            count = self.kv.get(key)
+        rate_keys = await self.kv.scan_keys(f"{self.rate_limit_prefix}*")
+        for key, count in zip(rate_keys, await self.kv.get_many(rate_keys, codec=JSON_CODEC)):
             debug_info["rate_limits"].append({
                 "phone": key.replace(self.rate_limit_prefix, ""),
                 "attempts": count
@@ -8,11 +8,11 @@ Timeline:
   T=20s -> End the Live Activity
 """
 import asyncio
-import aiohttp
 import sys
 from typing import Dict
-from ..config import settings
+from ..config import settings, APP_ID_TO_API_KEY
 from ..models.schemas import SignalPostLiveActivityRequest
+from .one_signal_message_service import onesignal_message_service
 
 
 # ---------- Content State Payloads ----------
@@ -155,27 +155,30 @@ class SignalPostLiveActivityService:
             "priority": 10,
         }
 
+        # Use the key of the app the activity belongs to (defaults to Signal Post)
+        api_key = APP_ID_TO_API_KEY.get(app_id, settings.signal_post_api_key)
+
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Key {settings.signal_post_api_key}",
+            "Authorization": f"Key {api_key}",
             "Accept": "application/json",
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                print(f"\U0001F4E1 Making OneSignal Live Activity {event} request...", file=sys.stderr, flush=True)
+            print(f"\U0001F4E1 Making OneSignal Live Activity {event} request...", file=sys.stderr, flush=True)
 
-                async with session.post(
-                    url,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    print(f"\U0001F4E1 Response Status: {response.status}", file=sys.stderr, flush=True)
+            # Shared keep-alive session (same host as the message service)
+            async with onesignal_message_service.get_session().post(
+                url,
+                json=payload,
+                headers=headers
+            ) as response:
+                print(f"\U0001F4E1 Response Status: {response.status}", file=sys.stderr, flush=True)
 
-                    response_data = await response.json()
-                    print(f"\u2705 OneSignal Live Activity Response: {response_data}", file=sys.stderr, flush=True)
+                response_data = await response.json()
+                print(f"\u2705 OneSignal Live Activity Response: {response_data}", file=sys.stderr, flush=True)
 
-                    return response_data
+                return response_data
 
         except Exception as e:
             print(f"\u274C OneSignal Live Activity Request Failed: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
@@ -3,11 +3,128 @@
 Vercel KV Store wrapper
 Handles all interactions with Vercel's KV (Redis) storage
 """
-import json
-import redis
-from typing import Any, Dict, Optional
+import asyncio
+import fnmatch
+import heapq
+import logging
+import time
+import msgpack
+import orjson
+import re
+import redis.asyncio as aioredis
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, NamedTuple, Optional
 from ..config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class Codec(NamedTuple):
+    """How values are turned into what is stored, and back"""
+    encode: Callable[[Any], Any]
+    decode: Callable[[Any], Any]
+
+
+# JSON (orjson, straight to/from bytes) is the default; msgpack is smaller and
+# faster for compact records on hot paths (e.g. OTPs). Read a key with the
+# codec it was written with.
+JSON_CODEC = Codec(orjson.dumps, orjson.loads)
+MSGPACK_CODEC = Codec(msgpack.packb, msgpack.unpackb)
+
+
+# First bytes of a JSON document as orjson writes it (no leading whitespace)
+_JSON_START_BYTES = frozenset(b'{["-0123456789tfn')
+
+
+def _unpack_or_json(raw):
+    """
+    msgpack, or JSON for values written before the switch.
+
+    The decoder is picked by the first byte rather than by msgpack raising:
+    msgpack reads a lone ASCII digit as a fixint (b"5" -> 53) without error.
+    The app's msgpack records are maps/arrays (first byte 0x80 or above), so
+    they never start like JSON. A msgpack scalar that happens to be one of
+    those byte values (e.g. an int from 48 to 57) would be misread as JSON:
+    store bare numbers with JSON_CODEC.
+    """
+    if raw[0] in _JSON_START_BYTES:
+        return orjson.loads(raw)
+    return msgpack.unpackb(raw)
+
+
+# Codec for callers that don't pick one (settings.KV_SERIALIZER). With
+# msgpack, existing JSON values are told apart by their first byte (see
+# _unpack_or_json) and migrate as they're rewritten.
+# Counters (INCR) are plain ASCII numbers: always read them with JSON_CODEC.
+DEFAULT_CODEC = (
+    Codec(msgpack.packb, _unpack_or_json) if settings.KV_SERIALIZER == "msgpack" else JSON_CODEC
+)
+
+
+@lru_cache(maxsize=64)
+def _glob_regex(pattern: str) -> re.Pattern:
+    """Compiled matcher for a key pattern, built once per pattern"""
+    return re.compile(fnmatch.translate(pattern))
+
+
+# Values at least this large are (de)serialized in a worker thread so a
+# multi-MB encode/decode doesn't stall the event loop
+LARGE_VALUE_BYTES = 1 << 20
+
+
+def _approx_size(value: Any) -> int:
+    """Cheap lower bound of a value's encoded size: str/bytes lengths one level deep"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return 0
+    return sum(len(v) for v in value if isinstance(v, (str, bytes, bytearray)))
+
+
+def _is_large(raw: Any) -> bool:
+    return type(raw) is bytes and len(raw) >= LARGE_VALUE_BYTES
+
+
+# Local fallback: most keys kept (least recently used are evicted first)
+LOCAL_MAX_KEYS = 10_000
+
+
+class _LocalEntry(NamedTuple):
+    """A local storage value and its monotonic expiry (None = no TTL)"""
+    expires_at: Optional[float]
+    value: Any
+
+
+# Returned by KVStore.get_or_missing for keys that don't exist
+MISSING = object()
+
+# INCR that also sets an expiry when the counter has none yet, atomically on
+# the server (one EVALSHA round-trip; no window between the INCR and EXPIRE)
+_INCR_WITH_TTL_LUA = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return value
+"""
+
+# One-shot claim on an existing key: SET NX a marker next to it and shorten
+# both to the same TTL. Returns -1 if the key is gone, 0 if it was already
+# claimed, 1 if this call claimed it. The stored value itself is not rewritten.
+_CLAIM_ONCE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+if not redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
 
 class KVStore:
     """
@@ -16,71 +133,146 @@ class KVStore:
     """
     
     def __init__(self):
+        # The Redis client is created by connect(); until then (or without
+        # credentials) everything goes to local memory
         self.redis_client = None
-        self.local_storage = {}  # Fallback for local dev
-        
-        # Try to connect to Vercel KV
-        if settings.KV_REST_API_URL and settings.KV_REST_API_TOKEN:
-            try:
-                # Parse the Redis URL
-                self.redis_client = redis.from_url(
-                    settings.KV_URL,
-                    decode_responses=True  # Get strings instead of bytes
-                )
-                # Test connection
-                self.redis_client.ping()
-                print("✅ Connected to Vercel KV")
-            except Exception as e:
-                print(f"⚠️  Could not connect to Vercel KV: {e}")
-                print("📝 Using local memory storage")
-        else:
-            print("📝 No KV credentials found - using local memory storage")
+        self._pool: Optional[aioredis.ConnectionPool] = None
+        self._incr_with_ttl = None  # Registered Lua scripts (Redis only)
+        self._claim_once = None
+        self._has_unlink = False  # Server supports UNLINK (Redis 4+), set by connect()
+        # Fallback for local dev: key -> _LocalEntry, least recently used first
+        self.local_storage: OrderedDict[str, _LocalEntry] = OrderedDict()
+        # (expires_at, key) min-heap over local keys with a TTL, so a purge only
+        # touches keys that are due; entries for keys since rewritten are skipped
+        self._expiry_heap: list = []
+    
+    async def connect(self):
+        """
+        Connect to Vercel KV if configured (call from the app lifespan)
+        Opens a shared async connection pool and checks it with a PING.
+        """
+        if not (settings.KV_REST_API_URL and settings.KV_REST_API_TOKEN):
+            logger.warning("📝 No KV credentials found - using local memory storage")
+            return
+        
+        try:
+            # One pool per process, kept warm: TCP keepalive on idle connections,
+            # a PING before reusing one idle for 30s, and a 2s cap on socket waits
+            self._pool = aioredis.ConnectionPool.from_url(
+                settings.KV_URL,
+                decode_responses=False,  # Values come back as bytes (msgpack is binary)
+                max_connections=settings.KV_MAX_CONNECTIONS,
+                socket_keepalive=True,
+                socket_timeout=2.0,
+                health_check_interval=30
+            )
+            client = aioredis.Redis(connection_pool=self._pool)
+            await client.ping()
+            self.redis_client = client
+            # Sent as EVALSHA; redis-py loads the script on first NOSCRIPT
+            self._incr_with_ttl = client.register_script(_INCR_WITH_TTL_LUA)
+            self._claim_once = client.register_script(_CLAIM_ONCE_LUA)
+            self._has_unlink = await self._detect_unlink(client)
+            logger.info("✅ Connected to Vercel KV")
+        except Exception as e:
+            logger.error("⚠️  Could not connect to Vercel KV: %s", e)
+            logger.warning("📝 Using local memory storage")
+            if self._pool:
+                await self._pool.disconnect()
+                self._pool = None
+    
+    @staticmethod
+    async def _detect_unlink(client) -> bool:
+        """Whether the server has UNLINK (Redis 4.0+); DEL is used if unsure"""
+        try:
+            # Probe with a key that never exists (INFO is restricted on some hosted Redis)
+            await client.unlink("kv_store:unlink_probe")
+            return True
+        except Exception:
+            return False
+    
+    async def close(self):
+        """Close the Redis connection pool"""
+        if self._pool:
+            self.redis_client = None
+            self._incr_with_ttl = None
+            self._claim_once = None
+            await self._pool.disconnect()
+            self._pool = None
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None, codec: Codec = DEFAULT_CODEC) -> bool:
         """
         Store a value with optional TTL (time to live in seconds)
         
         Args:
             key: The key to store
-            value: The value (will be JSON serialized)
+            value: The value (serialized with `codec`, settings.KV_SERIALIZER by default)
             ttl: Optional expiration time in seconds
+            codec: Value serialization
         
         Returns:
             True if successful
         """
         try:
-            # Serialize the value
-            json_value = json.dumps(value)
+            # Serialize the value (off the event loop when it's large)
+            if _approx_size(value) >= LARGE_VALUE_BYTES:
+                json_value = await asyncio.to_thread(codec.encode, value)
+            else:
+                json_value = codec.encode(value)
             
             if self.redis_client:
                 # Use Redis
-                print(f"KV SET: Attempting to store key: {key}")
                 if ttl:
-                    result = self.redis_client.setex(key, ttl, json_value)
+                    result = await self.redis_client.setex(key, ttl, json_value)
                 else:
-                    result = self.redis_client.set(key, json_value)
-                print(f"KV SET: Result: {result}")
-                
-                # Verify it was stored
-                test_get = self.redis_client.get(key)
-                print(f"KV SET: Verification read: {test_get is not None}")
+                    result = await self.redis_client.set(key, json_value)
+                logger.debug("KV SET %s: %s", key, result)
             else:
                 # Use local storage
-                print(f"LOCAL SET: Storing key: {key}")
-                self.local_storage[key] = {
-                    'value': json_value,
-                    'ttl': ttl,
-                    'timestamp': None  # Would need datetime for TTL simulation
-                }
+                logger.debug("LOCAL SET %s", key)
+                self._local_set(key, json_value, ttl, time.monotonic())
             
             return True
             
         except Exception as e:
-            print(f"Error storing {key}: {e}")
-            print(f"Error type: {type(e).__name__}")
+            logger.error("Error storing %s: %s: %s", key, type(e).__name__, e)
             return False
-    
-    def get(self, key: str) -> Optional[Any]:
+
+    async def set_many(self, items: list, codec: Codec = DEFAULT_CODEC) -> bool:
+        """
+        Store several values in one round-trip (Redis MULTI/EXEC pipeline)
+
+        Args:
+            items: List of (key, value, ttl) tuples; ttl may be None
+            codec: Value serialization
+
+        Returns:
+            True if successful
+        """
+        try:
+            if self.redis_client:
+                pipe = self.redis_client.pipeline(transaction=True)
+                for key, value, ttl in items:
+                    json_value = codec.encode(value)
+                    if ttl:
+                        pipe.setex(key, ttl, json_value)
+                    else:
+                        pipe.set(key, json_value)
+                result = await pipe.execute()
+                logger.debug("KV SET %d keys: %s", len(items), result)
+            else:
+                now = time.monotonic()
+                for key, value, ttl in items:
+                    logger.debug("LOCAL SET %s", key)
+                    self._local_set(key, codec.encode(value), ttl, now)
+
+            return True
+
+        except Exception as e:
+            logger.error("Error storing %d keys: %s: %s", len(items), type(e).__name__, e)
+            return False
+
+    async def get(self, key: str, codec: Codec = DEFAULT_CODEC) -> Optional[Any]:
         """
         Retrieve a value by key
         
@@ -89,28 +281,77 @@ class KVStore:
         """
         try:
             if self.redis_client:
-                json_value = self.redis_client.get(key)
+                json_value = await self.redis_client.get(key)
             else:
-                stored = self.local_storage.get(key)
-                json_value = stored['value'] if stored else None
+                json_value = self._local_get(key)
             
-            if json_value:
-                return json.loads(json_value)
-            return None
+            if _is_large(json_value):
+                return await asyncio.to_thread(self._decode, json_value, codec)
+            return self._decode(json_value, codec)
             
         except Exception as e:
             return None
     
-    def delete(self, key: str) -> bool:
+    async def get_or_missing(self, key: str, codec: Codec = DEFAULT_CODEC, sentinel: Any = MISSING) -> Any:
+        """
+        Retrieve a value, telling a missing key apart from a stored null
+        
+        One GET answers both "does it exist" and "what is it", so callers
+        don't need exists() first.
+        
+        Returns:
+            The deserialized value, or `sentinel` (MISSING) if the key doesn't exist
+        """
+        try:
+            if self.redis_client:
+                raw = await self.redis_client.get(key)
+            else:
+                raw = self._local_get(key)
+            
+            if raw is None:
+                return sentinel
+            if _is_large(raw):
+                return await asyncio.to_thread(self._decode, raw, codec)
+            return self._decode(raw, codec)
+            
+        except Exception as e:
+            return sentinel
+    
+    async def get_many(self, keys: list, codec: Codec = DEFAULT_CODEC) -> list:
+        """
+        Retrieve several values in one round-trip (Redis MGET)
+        
+        Returns:
+            The deserialized values in key order, None for missing keys
+        """
+        if not keys:
+            return []
+        try:
+            if self.redis_client:
+                json_values = await self.redis_client.mget(keys)
+            else:
+                json_values = [self._local_get(key) for key in keys]
+            
+            if any(map(_is_large, json_values)):
+                # One thread hop for the whole batch
+                return await asyncio.to_thread(
+                    lambda: [self._decode(v, codec) for v in json_values]
+                )
+            return [self._decode(v, codec) for v in json_values]
+            
+        except Exception as e:
+            return [None] * len(keys)
+    
+    async def delete(self, key: str) -> bool:
         """
-        Delete a key
+        Delete a key (UNLINK on Redis: the value is freed in the background)
         
         Returns:
             True if the key was deleted
         """
         try:
             if self.redis_client:
-                return bool(self.redis_client.delete(key))
+                return bool(await self._unlink(key))
             else:
                 if key in self.local_storage:
                     del self.local_storage[key]
@@ -120,43 +361,130 @@ class KVStore:
         except Exception as e:
             return False
     
-    def exists(self, key: str) -> bool:
+    async def delete_many(self, keys: list) -> int:
+        """
+        Delete several keys in one round-trip (variadic Redis UNLINK/DEL)
+        
+        Returns:
+            Number of keys deleted
+        """
+        if not keys:
+            return 0
+        try:
+            if self.redis_client:
+                return await self._unlink(*keys)
+            else:
+                return sum(self.local_storage.pop(key, None) is not None for key in keys)
+                
+        except Exception as e:
+            return 0
+    
+    async def exists(self, key: str) -> bool:
         """
         Check if a key exists
         
+        If the value is needed too, use get_or_missing() instead (one round-trip).
+        
         Returns:
             True if the key exists
         """
         try:
             if self.redis_client:
-                return bool(self.redis_client.exists(key))
+                return bool(await self.redis_client.exists(key))
             else:
-                return key in self.local_storage
+                return self._local_get(key) is not None
                 
         except Exception as e:
             return False
     
-    def increment(self, key: str, amount: int = 1) -> int:
+    async def count_existing(self, keys: list) -> int:
+        """
+        Count how many of several keys exist (one variadic Redis EXISTS)
+        
+        Returns:
+            Number of the keys that exist
+        """
+        if not keys:
+            return 0
+        try:
+            if self.redis_client:
+                return await self.redis_client.exists(*keys)
+            else:
+                return sum(self._local_get(key) is not None for key in keys)
+                
+        except Exception as e:
+            return 0
+    
+    async def increment(self, key: str, amount: int = 1, ttl: Optional[int] = None) -> int:
         """
         Increment a counter
         
+        Args:
+            key: The counter key
+            amount: How much to add
+            ttl: Optional expiry in seconds, set only if the counter has none yet
+                 (atomically with the increment, in the same round-trip)
+        
         Returns:
             The new value
         """
         try:
             if self.redis_client:
-                return self.redis_client.incr(key, amount)
+                if not ttl:
+                    return await self.redis_client.incr(key, amount)
+                return await self._incr_with_ttl(keys=[key], args=[amount, ttl])
             else:
-                # Local simulation
-                current = self.get(key) or 0
+                # Local simulation (keeps the key's existing expiry, like INCR).
+                # The counter is stored as a plain int: nothing to encode or decode.
+                current = self._local_get(key)
+                if current is None:
+                    current = 0
+                elif type(current) is not int:
+                    current = JSON_CODEC.decode(current)  # Written by set()
                 new_value = current + amount
-                self.set(key, new_value)
+                stored = self.local_storage.get(key)
+                if stored is None or (ttl and stored.expires_at is None):
+                    self._local_set(key, new_value, ttl, time.monotonic())
+                else:
+                    self.local_storage[key] = stored._replace(value=new_value)
                 return new_value
                 
         except Exception as e:
             return 0
     
-    def get_keys(self, pattern: str = "*") -> list:
+    async def claim_once(self, key: str, marker_key: str, ttl: int) -> int:
+        """
+        Atomically mark an existing key as claimed, at most once
+        
+        Sets marker_key only if it isn't set yet and gives both keys the
+        same TTL, in one round-trip; the value at key is left untouched.
+        
+        Args:
+            key: The key being claimed (must exist)
+            marker_key: Where the claim is recorded
+            ttl: Expiry in seconds for both keys after a successful claim
+        
+        Returns:
+            1 if claimed by this call, 0 if already claimed, -1 if key doesn't exist
+        """
+        try:
+            if self.redis_client:
+                return await self._claim_once(keys=[key, marker_key], args=[ttl])
+            else:
+                value = self._local_get(key)
+                if value is None:
+                    return -1
+                if self._local_get(marker_key) is not None:
+                    return 0
+                now = time.monotonic()
+                self._local_set(marker_key, "1", ttl, now)
+                self._local_set(key, value, ttl, now)
+                return 1
+                
+        except Exception as e:
+            return -1
+    
+    async def get_keys(self, pattern: str = "*") -> list:
         """
         Get all keys matching a pattern
         
@@ -168,18 +496,123 @@ class KVStore:
         """
         try:
             if self.redis_client:
-                return self.redis_client.keys(pattern)
+                # SCAN rather than KEYS, which blocks the server for the whole keyspace
+                return await self.scan_keys(pattern)
             else:
                 # Local pattern matching (simple)
-                import fnmatch
-                return [k for k in self.local_storage.keys() 
-                       if fnmatch.fnmatch(k, pattern)]
+                self.purge_expired()
+                match = _glob_regex(pattern).match
+                return [k for k in self.local_storage if match(k)]
+                
+        except Exception as e:
+            return []
+
+    async def scan_keys(self, pattern: str = "*", count: int = 500) -> list:
+        """
+        Get all keys matching a pattern with cursor-based SCAN
+        
+        Unlike KEYS, SCAN walks the keyspace in small steps, so it never
+        blocks the Redis server for the whole scan.
+        
+        Args:
+            pattern: Redis pattern (e.g., "otp:*" for all OTP keys)
+            count: Keys Redis examines per SCAN step (a hint)
+            
+        Returns:
+            List of matching keys
+        """
+        if not self.redis_client:
+            return await self.get_keys(pattern)
+        try:
+            keys = []
+            cursor = 0
+            while True:
+                cursor, batch = await self.redis_client.scan(cursor=cursor, match=pattern, count=count)
+                keys.extend(k.decode() for k in batch)
+                if cursor == 0:
+                    # SCAN may repeat a key if the keyspace is resized mid-scan
+                    return list(dict.fromkeys(keys))
                 
         except Exception as e:
             return []
 
+    async def iter_keys(self, pattern: str = "*", count: int = 500) -> AsyncIterator[str]:
+        """
+        Yield keys matching a pattern as SCAN returns them, without building a list
+        
+        Keys may repeat if the keyspace is resized mid-scan (SCAN semantics).
+        
+        Args:
+            pattern: Redis pattern (e.g., "otp:*" for all OTP keys)
+            count: Keys Redis examines per SCAN step (a hint)
+        """
+        if self.redis_client:
+            async for key in self.redis_client.scan_iter(match=pattern, count=count):
+                yield key.decode()
+        else:
+            for key in await self.get_keys(pattern):
+                yield key
+
+    async def _unlink(self, *keys: str) -> int:
+        """Delete keys on Redis, freeing their memory in the background when UNLINK is available"""
+        if self._has_unlink:
+            return await self.redis_client.unlink(*keys)
+        return await self.redis_client.delete(*keys)
+    
+    @staticmethod
+    def _decode(raw: Any, codec: Codec) -> Optional[Any]:
+        """Deserialize a stored value (local counters are already plain ints)"""
+        if type(raw) is int:
+            return raw
+        return codec.decode(raw) if raw else None
+    
+    def _local_set(self, key: str, json_value: Any, ttl: Optional[int], now: float) -> None:
+        """Write a raw value to local storage and index its expiry, evicting past LOCAL_MAX_KEYS"""
+        expires_at = now + ttl if ttl else None
+        storage = self.local_storage
+        storage[key] = _LocalEntry(expires_at, json_value)
+        storage.move_to_end(key)
+        if len(storage) > LOCAL_MAX_KEYS:
+            storage.popitem(last=False)  # Its heap entry, if any, goes stale
+        if expires_at is not None:
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+    
+    def _local_get(self, key: str) -> Optional[Any]:
+        """Read a raw value from local storage, dropping it if its TTL has passed"""
+        stored = self.local_storage.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at is not None and stored.expires_at <= time.monotonic():
+            del self.local_storage[key]
+            return None
+        self.local_storage.move_to_end(key)
+        return stored.value
+    
+    def purge_expired(self) -> int:
+        """
+        Remove expired keys from local storage (Redis expires keys itself)
+        
+        Returns:
+            Number of keys removed
+        """
+        now = time.monotonic()
+        heap = self._expiry_heap
+        removed = 0
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            stored = self.local_storage.get(key)
+            # Skip stale entries: the key was deleted or rewritten with another expiry
+            if stored is not None and stored.expires_at == expires_at:
+                del self.local_storage[key]
+                removed += 1
+        return removed
+    
+    async def sweep_expired(self, interval: float = 60):
+        """Background task: purge expired local keys every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            self.purge_expired()
+
 
-# Create a singleton instance
-print("Creating KV store instance...")
-kv_store = KVStore()
-print("KV store instance created")
\ No newline at end of file
+# Create a singleton instance (connected in the app lifespan)
+kv_store = KVStore()
\ No newline at end of file
@@ -2,17 +2,30 @@
 """
 Entry point for running the server locally
 """
+import os
 import uvicorn
 
+from api.config import settings
+
 if __name__ == "__main__":
     print("Starting server at http://localhost:8000")
     print("View API docs at http://localhost:8000/docs")
     print("View alternative docs at http://localhost:8000/redoc")
-    
-    # Run the server
+
+    # Auto-reload only while developing; otherwise one worker process per core.
+    # Without KV every worker would have its own in-memory store (an OTP sent
+    # by one worker couldn't be verified by another), so that stays at 1.
+    reload = settings.is_development
+    default_workers = (os.cpu_count() or 1) if settings.has_kv else 1
+    workers = 1 if reload else int(os.getenv("WEB_CONCURRENCY", default_workers))
+    # Workers read it to size their share of the Postgres pool (api/config.py)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    # Run the server (uvicorn picks uvloop and httptools when they're installed)
     uvicorn.run(
         "api.main:app",  # Path to your FastAPI app
         host="0.0.0.0",
         port=8000,
-        reload=True  # Auto-reload when you change code!
-    )
\ No newline at end of file
+        reload=reload,  # Auto-reload when you change code!
+        workers=workers
+    )
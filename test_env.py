@@ -1,10 +1,7 @@
 # test_env.py
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
+from api.config import settings
 
 print("Testing .env file:")
-print(f"KV_URL exists: {bool(os.getenv('KV_URL'))}")
-print(f"KV_REST_API_URL: {os.getenv('KV_REST_API_URL')}")
-print(f"KV_REST_API_TOKEN exists: {bool(os.getenv('KV_REST_API_TOKEN'))}")
\ No newline at end of file
+print(f"KV_URL exists: {bool(settings.KV_URL)}")
+print(f"KV_REST_API_URL: {settings.KV_REST_API_URL}")
+print(f"KV_REST_API_TOKEN exists: {bool(settings.KV_REST_API_TOKEN)}")